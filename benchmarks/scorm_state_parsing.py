@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the SCORM state handling of set_raw_scorm_status
+
+Times, for states of 3 SCOs with a growing number of interactions, the JSON
+round trips the handler made before the state was parsed once into a
+ScormState (SCO initialisation re-parsing and re-serializing the stored state
+for every value set, the progress helpers walking the parsed JSON), against
+the current parsing of both states once.
+
+    python benchmarks/scorm_state_parsing.py
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import sys
+import timeit
+
+from six.moves import range
+
+# scorm_state and scorm_summary don't need the LMS, unlike the scormxblock package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scormxblock'))
+
+from scorm_state import ScormState  # noqa: E402 pylint: disable=wrong-import-position
+from scorm_summary import summarize_scos  # noqa: E402 pylint: disable=wrong-import-position
+
+SCOS = 3
+INTERACTIONS = (100, 1000)
+NUMBER = 20
+REPEAT = 3
+
+
+def scorm_status(interactions):
+    return json.dumps({'status': 'incomplete', 'score': '', 'scos': dict(
+        ('sco{}'.format(sco), {'data': dict(
+            [('cmi.interactions.{}.{}'.format(index, key), 'x' * 20)
+             for index in range(interactions) for key in ('id', 'result', 'student_response')] +
+            [('cmi.progress_measure', '0.5'), ('cmi.core.lesson_status', 'incomplete')]
+        )}) for sco in range(SCOS)
+    )})
+
+
+def before(stored_status, posted_status):
+    """
+    set_raw_scorm_status as it was: every SCO value set parsed and serialized
+    the stored state again, the progress helpers parsed it once more
+    """
+    posted = json.loads(posted_status)
+    raw_scorm_status = stored_status
+    for key, value, overwrite in (('cmi.core.credit', 'credit', False),
+                                  ('cmi.core.lesson_status', 'not attempted', True)):
+        scos = json.loads(raw_scorm_status).get('scos')
+        for sco in scos.values():
+            if not sco.get('key') or overwrite:
+                sco[key] = value
+        status = json.loads(raw_scorm_status)
+        status['scos'] = scos
+        raw_scorm_status = json.dumps(status)
+    stored = json.loads(raw_scorm_status)
+    for state in (posted, stored):
+        sum(float(sco.get('data', {}).get('cmi.progress_measure', '0')) for sco in state['scos'].values())
+
+
+def after(stored_status, posted_status):
+    """
+    set_raw_scorm_status now: both states parsed once, changed in place and summarized
+    """
+    posted = ScormState.from_json(posted_status)
+    stored = ScormState.from_json(stored_status)
+    stored.set_sco_values('cmi.core.credit', 'credit')
+    stored.set_sco_values('cmi.core.lesson_status', 'not attempted', True)
+    summarize_scos(posted.scos)
+
+
+def best_time(function, *args):
+    return min(timeit.repeat(lambda: function(*args), number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    for interactions in INTERACTIONS:
+        stored_status = posted_status = scorm_status(interactions)
+        print('{}KB state: {:.2f}ms -> {:.2f}ms'.format(
+            len(stored_status) // 1024,
+            best_time(before, stored_status, posted_status) * 1000,
+            best_time(after, stored_status, posted_status) * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Stores for the chunks of a SCORM package upload
+
+A chunked upload can be spread over several app nodes, so the chunks can either
+be kept on local disk (single node) or in the configured Django storage, where
+every node can see them.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CHUNK_STORE = 'local'
+STORAGE_CHUNK_STORE = 'storage'
+
+# storage directory for chunks of uploads in progress
+DEFAULT_CHUNK_STORAGE_DIR = 'scorm_uploads'
+
+# storage names of chunk files, e.g; "00000000000-00019999999"
+CHUNK_NAME_FORMAT = '{:011d}-{:011d}'
+CHUNK_NAME_RE = re.compile(r"^(?P<start>\d{11})-(?P<end>\d{11})$")
+
+# storage name of the metadata of the upload in progress
+UPLOAD_META_NAME = 'upload.json'
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class IncompleteUploadError(Exception):
+    """
+    The package is being assembled but some of its bytes never arrived
+    """
+    def __init__(self, message):
+        super(IncompleteUploadError, self).__init__(message)
+        self.message = message
+
+
+def merge_ranges(ranges):
+    """
+    Merge inclusive (start, end) byte ranges into a sorted list of disjoint ranges
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def contiguous_size(ranges):
+    """
+    Number of bytes received without a gap from the start of the file
+    """
+    merged = merge_ranges(ranges)
+    return merged[0][1] + 1 if merged and merged[0][0] == 0 else 0
+
+
+def covers(ranges, size):
+    """
+    Whether the byte ranges cover a file of `size` bytes from start to end
+    """
+    merged = merge_ranges(ranges)
+    return size == 0 or (len(merged) == 1 and merged[0][0] == 0 and merged[0][1] >= size - 1)
+
+
+class LocalChunkStore(object):
+    """
+    Writes chunks at their offset in a single file in the local temp directory,
+    keeping track of the received byte ranges in a sidecar file.
+    Only works if all chunks of an upload reach the same node.
+    """
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+        self.path = os.path.join(tempfile.gettempdir(), upload_id)
+        self.meta_path = '{}.json'.format(self.path)
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                return json.load(meta_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_meta(self, meta):
+        with open(self.meta_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+    def begin(self, upload_key):
+        """
+        Start or resume the upload identified by `upload_key`,
+        dropping whatever was received for another upload
+        """
+        if self._read_meta().get('upload_key') != upload_key:
+            self.cleanup()
+            self._write_meta({'upload_key': upload_key, 'ranges': []})
+
+    def write_chunk(self, start, end, chunk_file):
+        mode = 'rb+' if os.path.exists(self.path) else 'wb+'
+        with open(self.path, mode) as temp_file:
+            temp_file.seek(start)
+            for chunk in chunk_file.chunks():
+                temp_file.write(chunk)
+
+        meta = self._read_meta()
+        meta['ranges'] = merge_ranges([tuple(r) for r in meta.get('ranges', [])] + [(start, end)])
+        self._write_meta(meta)
+
+    def received_ranges(self, upload_key=None):
+        meta = self._read_meta()
+        if upload_key is not None and meta.get('upload_key') != upload_key:
+            return []
+        return [tuple(r) for r in meta.get('ranges', [])]
+
+    def received_size(self, upload_key=None):
+        return sum(end - start + 1 for start, end in self.received_ranges(upload_key))
+
+    def uploaded_bytes(self, upload_key=None):
+        """
+        Offset the upload can resume from
+        """
+        return contiguous_size(self.received_ranges(upload_key))
+
+    def assemble(self, target_path, size=None):
+        """
+        Make the complete upload available at `target_path`, returns the path
+        """
+        if size is not None and not covers(self.received_ranges(), size):
+            raise IncompleteUploadError(
+                'Upload incomplete: received {} of {} bytes'.format(self.received_size(), size)
+            )
+        if target_path != self.path:
+            shutil.move(self.path, target_path)
+        return target_path
+
+    def cleanup(self):
+        for path in (self.path, self.meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class StorageChunkStore(object):
+    """
+    Saves every chunk as its own object in Django storage, named after the byte
+    range it holds, so chunks can land on any node. The package is assembled to
+    a local file once the upload is complete.
+    """
+    def __init__(self, upload_id, storage, location=DEFAULT_CHUNK_STORAGE_DIR):
+        self.upload_id = upload_id
+        self.storage = storage
+        self.location = os.path.join(location, upload_id)
+
+    def _chunk_path(self, start, end):
+        return os.path.join(self.location, CHUNK_NAME_FORMAT.format(start, end))
+
+    def _chunks(self):
+        """
+        Stored chunks as a sorted list of (start, end, storage path)
+        """
+        try:
+            _, files = self.storage.listdir(self.location)
+        except OSError:  # nothing stored yet on a local file system storage
+            return []
+
+        chunks = []
+        for name in files:
+            matches = CHUNK_NAME_RE.match(name)
+            if matches:
+                start, end = int(matches.group('start')), int(matches.group('end'))
+                chunks.append((start, end, os.path.join(self.location, name)))
+        return sorted(chunks)
+
+    def _read_upload_key(self):
+        meta_path = os.path.join(self.location, UPLOAD_META_NAME)
+        try:
+            if not self.storage.exists(meta_path):
+                return None
+            with self.storage.open(meta_path, 'rb') as meta_file:
+                return json.loads(meta_file.read().decode('utf-8')).get('upload_key')
+        except (IOError, ValueError):
+            return None
+
+    def begin(self, upload_key):
+        """
+        Start or resume the upload identified by `upload_key`,
+        dropping whatever was received for another upload
+        """
+        if self._read_upload_key() != upload_key:
+            self.cleanup()
+            self.storage.save(
+                os.path.join(self.location, UPLOAD_META_NAME),
+                ContentFile(json.dumps({'upload_key': upload_key}).encode('utf-8'))
+            )
+
+    def write_chunk(self, start, end, chunk_file):
+        # a resent chunk replaces the earlier copy instead of adding bytes
+        chunk_path = self._chunk_path(start, end)
+        self.storage.delete(chunk_path)
+        self.storage.save(chunk_path, chunk_file)
+
+    def received_ranges(self, upload_key=None):
+        if upload_key is not None and self._read_upload_key() != upload_key:
+            return []
+        return merge_ranges((start, end) for start, end, _ in self._chunks())
+
+    def received_size(self, upload_key=None):
+        return sum(end - start + 1 for start, end in self.received_ranges(upload_key))
+
+    def uploaded_bytes(self, upload_key=None):
+        """
+        Offset the upload can resume from
+        """
+        return contiguous_size(self.received_ranges(upload_key))
+
+    def assemble(self, target_path, size=None):
+        """
+        Concatenate the stored chunks into `target_path`, returns the path
+        """
+        chunks = self._chunks()
+        if size is not None and not covers([(start, end) for start, end, _ in chunks], size):
+            raise IncompleteUploadError(
+                'Upload incomplete: received {} of {} bytes'.format(self.received_size(), size)
+            )
+
+        offset = 0
+        with open(target_path, 'wb') as target_file:
+            for start, end, chunk_path in chunks:
+                if end < offset:
+                    continue  # chunk was fully covered by earlier ones
+                with self.storage.open(chunk_path, 'rb') as chunk_file:
+                    overlap = offset - start
+                    if overlap > 0:
+                        chunk_file.read(overlap)
+                    shutil.copyfileobj(chunk_file, target_file, COPY_BUFFER_SIZE)
+                offset = end + 1
+
+        return target_path
+
+    def cleanup(self):
+        chunk_paths = [chunk_path for _, _, chunk_path in self._chunks()]
+        for path in chunk_paths + [os.path.join(self.location, UPLOAD_META_NAME)]:
+            try:
+                self.storage.delete(path)
+            except Exception as e:
+                logger.warning('Could not delete upload chunk {}: {}'.format(path, e))
+
+
+def get_chunk_store(store_type, upload_id, storage, location=DEFAULT_CHUNK_STORAGE_DIR):
+    if store_type == STORAGE_CHUNK_STORE:
+        return StorageChunkStore(upload_id, storage, location)
+    return LocalChunkStore(upload_id)
@@ -0,0 +1,303 @@
+"""
+SCORM 1.2 and 2004 CMI data model of a learner's SCORM state
+
+Lets players talking JSON to the block read and write CMI elements one by one
+or many at a time. Elements are read from the parsed state, values written
+are validated and collected as a merge patch, so the handler can apply all of
+them and save the state once.
+"""
+from __future__ import absolute_import
+
+import re
+
+import six
+
+SCORM_12 = '1.2'
+SCORM_2004 = '2004'
+
+# key of the SCO in the stored state when the player doesn't name one
+DEFAULT_SCO_ID = 'sco'
+
+NO_ERROR = '0'
+# error codes by SCORM version
+ERRORS = {
+    SCORM_12: {'undefined': '401', 'read_only': '403', 'type_mismatch': '405', 'out_of_range': '405'},
+    SCORM_2004: {'undefined': '401', 'read_only': '404', 'type_mismatch': '406', 'out_of_range': '407'},
+}
+
+READ_ONLY = 'r'
+READ_WRITE = 'rw'
+
+LESSON_STATUSES = ('passed', 'completed', 'failed', 'incomplete', 'browsed', 'not attempted')
+COMPLETION_STATUSES = ('completed', 'incomplete', 'not attempted', 'unknown')
+SUCCESS_STATUSES = ('passed', 'failed', 'unknown')
+INTERACTION_TYPES_12 = ('true-false', 'choice', 'fill-in', 'matching', 'performance', 'sequencing', 'likert',
+                        'numeric')
+INTERACTION_TYPES_2004 = INTERACTION_TYPES_12 + ('long-fill-in', 'other')
+INTERACTION_RESULTS = ('correct', 'wrong', 'unanticipated', 'neutral')
+
+TIMESPAN_12_RE = re.compile(r'^\d{2,4}:\d{2}:\d{2}(\.\d{1,2})?$')
+TIME_12_RE = re.compile(r'^\d{2}:\d{2}:\d{2}(\.\d{1,2})?$')
+DURATION_2004_RE = re.compile(r'^P(?!$)(\d+Y)?(\d+M)?(\d+D)?(T(?=\d)(\d+H)?(\d+M)?(\d+(\.\d{1,2})?S)?)?$')
+INDEXED_RE = re.compile(r'^(cmi\.(?:interactions|objectives))\.(\d+)\.')
+
+
+class CmiValueError(ValueError):
+    """
+    A value can't be set, `reason` is a key of ERRORS
+    """
+    def __init__(self, reason):
+        super(CmiValueError, self).__init__(reason)
+        self.reason = reason
+
+
+def _string(max_length):
+    def validate(value):
+        if len(value) > max_length:
+            raise CmiValueError('type_mismatch')
+        return value
+    return validate
+
+
+def _vocabulary(*values):
+    def validate(value):
+        if value not in values:
+            raise CmiValueError('type_mismatch')
+        return value
+    return validate
+
+
+def _decimal(minimum=None, maximum=None, blank=False):
+    def validate(value):
+        if blank and value == '':
+            return value
+        try:
+            number = float(value)
+        except ValueError:
+            raise CmiValueError('type_mismatch')
+        if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+            raise CmiValueError('out_of_range')
+        return value
+    return validate
+
+
+def _pattern(regex):
+    def validate(value):
+        if not regex.match(value):
+            raise CmiValueError('type_mismatch')
+        return value
+    return validate
+
+
+def _interaction_result(value):
+    if value in INTERACTION_RESULTS:
+        return value
+    return _decimal()(value)
+
+
+# (element pattern, access, validator), the first matching pattern applies
+ELEMENTS = {
+    SCORM_12: [
+        (r'cmi\.core\.(student_id|student_name|credit|entry|total_time|lesson_mode)', READ_ONLY, None),
+        (r'cmi\.core\.lesson_location', READ_WRITE, _string(255)),
+        (r'cmi\.core\.lesson_status', READ_WRITE, _vocabulary(*LESSON_STATUSES)),
+        (r'cmi\.core\.score\.(raw|min|max)', READ_WRITE, _decimal(0, 100, blank=True)),
+        (r'cmi\.core\.exit', READ_WRITE, _vocabulary('time-out', 'suspend', 'logout', '')),
+        (r'cmi\.core\.session_time', READ_WRITE, _pattern(TIMESPAN_12_RE)),
+        (r'cmi\.suspend_data', READ_WRITE, _string(4096)),
+        (r'cmi\.(launch_data|comments_from_lms)', READ_ONLY, None),
+        (r'cmi\.comments', READ_WRITE, _string(4096)),
+        (r'cmi\.student_data\.(mastery_score|max_time_allowed|time_limit_action)', READ_ONLY, None),
+        (r'cmi\.student_preference\.(audio|speed|text)', READ_WRITE, _decimal(-100, 100)),
+        (r'cmi\.student_preference\.language', READ_WRITE, _string(255)),
+        (r'cmi\.objectives\.\d+\.id', READ_WRITE, _string(255)),
+        (r'cmi\.objectives\.\d+\.score\.(raw|min|max)', READ_WRITE, _decimal(0, 100, blank=True)),
+        (r'cmi\.objectives\.\d+\.status', READ_WRITE, _vocabulary(*LESSON_STATUSES)),
+        (r'cmi\.interactions\.\d+\.(id|objectives\.\d+\.id|correct_responses\.\d+\.pattern)', READ_WRITE,
+         _string(255)),
+        (r'cmi\.interactions\.\d+\.time', READ_WRITE, _pattern(TIME_12_RE)),
+        (r'cmi\.interactions\.\d+\.type', READ_WRITE, _vocabulary(*INTERACTION_TYPES_12)),
+        (r'cmi\.interactions\.\d+\.weighting', READ_WRITE, _decimal()),
+        (r'cmi\.interactions\.\d+\.student_response', READ_WRITE, _string(255)),
+        (r'cmi\.interactions\.\d+\.result', READ_WRITE, _interaction_result),
+        (r'cmi\.interactions\.\d+\.latency', READ_WRITE, _pattern(TIMESPAN_12_RE)),
+    ],
+    SCORM_2004: [
+        (r'cmi\.(learner_id|learner_name|credit|entry|total_time|mode|launch_data|completion_threshold|'
+         r'scaled_passing_score|max_time_allowed|time_limit_action)', READ_ONLY, None),
+        (r'cmi\.location', READ_WRITE, _string(1000)),
+        (r'cmi\.completion_status', READ_WRITE, _vocabulary(*COMPLETION_STATUSES)),
+        (r'cmi\.success_status', READ_WRITE, _vocabulary(*SUCCESS_STATUSES)),
+        (r'cmi\.score\.scaled', READ_WRITE, _decimal(-1, 1)),
+        (r'cmi\.score\.(raw|min|max)', READ_WRITE, _decimal()),
+        (r'cmi\.progress_measure', READ_WRITE, _decimal(0, 1)),
+        (r'cmi\.exit', READ_WRITE, _vocabulary('time-out', 'suspend', 'logout', 'normal', '')),
+        (r'cmi\.session_time', READ_WRITE, _pattern(DURATION_2004_RE)),
+        (r'cmi\.suspend_data', READ_WRITE, _string(64000)),
+        (r'cmi\.learner_preference\.(audio_level|delivery_speed)', READ_WRITE, _decimal(0)),
+        (r'cmi\.learner_preference\.audio_captioning', READ_WRITE, _vocabulary('-1', '0', '1')),
+        (r'cmi\.learner_preference\.language', READ_WRITE, _string(250)),
+        (r'cmi\.comments_from_lms\.\d+\.\w+', READ_ONLY, None),
+        (r'cmi\.comments_from_learner\.\d+\.(comment|location|timestamp)', READ_WRITE, _string(4000)),
+        (r'cmi\.objectives\.\d+\.(id|description)', READ_WRITE, _string(4000)),
+        (r'cmi\.objectives\.\d+\.score\.scaled', READ_WRITE, _decimal(-1, 1)),
+        (r'cmi\.objectives\.\d+\.score\.(raw|min|max)', READ_WRITE, _decimal()),
+        (r'cmi\.objectives\.\d+\.success_status', READ_WRITE, _vocabulary(*SUCCESS_STATUSES)),
+        (r'cmi\.objectives\.\d+\.completion_status', READ_WRITE, _vocabulary(*COMPLETION_STATUSES)),
+        (r'cmi\.objectives\.\d+\.progress_measure', READ_WRITE, _decimal(0, 1)),
+        (r'cmi\.interactions\.\d+\.type', READ_WRITE, _vocabulary(*INTERACTION_TYPES_2004)),
+        (r'cmi\.interactions\.\d+\.latency', READ_WRITE, _pattern(DURATION_2004_RE)),
+        (r'cmi\.interactions\.\d+\.weighting', READ_WRITE, _decimal()),
+        (r'cmi\.interactions\.\d+\.(id|timestamp|objectives\.\d+\.id|correct_responses\.\d+\.pattern|'
+         r'learner_response|result|description)', READ_WRITE, _string(64000)),
+    ],
+}
+ELEMENTS = dict(
+    (version, [(re.compile('^{}$'.format(pattern)), access, validate) for pattern, access, validate in elements])
+    for version, elements in ELEMENTS.items()
+)
+
+CHILDREN = {
+    SCORM_12: {
+        'cmi.core._children': 'student_id,student_name,lesson_location,credit,lesson_status,entry,score,'
+                              'total_time,lesson_mode,exit,session_time',
+        'cmi.core.score._children': 'raw,min,max',
+        'cmi.objectives._children': 'id,score,status',
+        'cmi.student_data._children': 'mastery_score,max_time_allowed,time_limit_action',
+        'cmi.student_preference._children': 'audio,language,speed,text',
+        'cmi.interactions._children': 'id,objectives,time,type,correct_responses,weighting,student_response,'
+                                      'result,latency',
+    },
+    SCORM_2004: {
+        'cmi._version': '1.0',
+        'cmi.score._children': 'scaled,raw,min,max',
+        'cmi.objectives._children': 'id,score,success_status,completion_status,progress_measure,description',
+        'cmi.learner_preference._children': 'audio_level,language,delivery_speed,audio_captioning',
+        'cmi.interactions._children': 'id,type,objectives,timestamp,correct_responses,weighting,'
+                                      'learner_response,result,latency,description',
+    },
+}
+
+# elements mirrored to the top level `status` and `score` of the state, read for grading
+STATUS_ELEMENTS = ('cmi.core.lesson_status', 'cmi.completion_status', 'cmi.success_status')
+SCORE_ELEMENTS = ('cmi.core.score.raw', 'cmi.score.raw')
+
+
+class CmiDataModel(object):
+    """
+    CMI elements of one SCO of a ScormState. `runtime_values` gives the read
+    only elements the LMS provides, such as the learner's id and name, and
+    `fallback_values` the values read of elements the SCO has no value of.
+    """
+    def __init__(self, scorm_state, version=SCORM_12, sco_id=DEFAULT_SCO_ID, runtime_values=None,
+                 fallback_values=None):
+        if version not in ELEMENTS:
+            raise ValueError('Unsupported SCORM version {}'.format(version))
+        self.version = version
+        self.sco_id = sco_id
+        self.runtime_values = runtime_values or {}
+        self.fallback_values = fallback_values or {}
+        self.sco_data = (scorm_state.scos.get(sco_id) or {}).get('data') or {}
+        self.changes = {}
+
+    def _error(self, reason):
+        return ERRORS[self.version][reason]
+
+    def _element(self, name):
+        for regex, access, validate in ELEMENTS[self.version]:
+            if regex.match(name):
+                return access, validate
+        return None
+
+    def get(self, name):
+        """
+        (value, error code) of the element `name`
+        """
+        if name in CHILDREN[self.version]:
+            return CHILDREN[self.version][name], NO_ERROR
+        if name.endswith('._count'):
+            return self._value(name, 0), NO_ERROR
+        if name in self.runtime_values:
+            return self._value(name, self.runtime_values[name]), NO_ERROR
+        if self._element(name) is None:
+            return '', self._error('undefined')
+        return self._value(name, ''), NO_ERROR
+
+    def _value(self, name, default):
+        if name in self.changes:
+            return self.changes[name]
+        return self.sco_data.get(name, self.fallback_values.get(name, default))
+
+    def set(self, name, value):
+        """
+        Validate and record a new value of the element `name`, returns an error code
+        """
+        element = self._element(name)
+        if element is None:
+            return self._error('undefined')
+        access, validate = element
+        if access == READ_ONLY:
+            return self._error('read_only')
+        if not isinstance(value, six.string_types):
+            value = six.text_type(value)
+        try:
+            self.changes[name] = validate(value)
+        except CmiValueError as e:
+            return self._error(e.reason)
+
+        # keep the counts of interactions and objectives, reports rely on them
+        indexed = INDEXED_RE.match(name)
+        if indexed:
+            count_name = '{}._count'.format(indexed.group(1))
+            count = int(indexed.group(2)) + 1
+            if self._count(count_name) < count:
+                self.changes[count_name] = count
+        return NO_ERROR
+
+    def _count(self, count_name):
+        try:
+            return int(self._value(count_name, 0))
+        except (TypeError, ValueError):
+            # players may store counts as strings, or anything
+            return 0
+
+    def get_many(self, names):
+        """
+        ({name: value}, {name: error code}) of the elements `names`
+        """
+        values, errors = {}, {}
+        for name in names:
+            value, error = self.get(name)
+            values[name] = value
+            if error != NO_ERROR:
+                errors[name] = error
+        return values, errors
+
+    def set_many(self, values):
+        """
+        Record new values of the elements, a dict of name to value. Returns
+        {name: error code} of the values that couldn't be set.
+        """
+        errors = {}
+        for name, value in values.items():
+            error = self.set(name, value)
+            if error != NO_ERROR:
+                errors[name] = error
+        return errors
+
+    def patch(self):
+        """
+        Merge patch of the state with the values set, None if nothing was
+        """
+        if not self.changes:
+            return None
+        patch = {'scos': {self.sco_id: {'data': dict(self.changes)}}}
+        for name in STATUS_ELEMENTS:
+            if name in self.changes and self.changes[name] != 'unknown':
+                patch['status'] = self.changes[name]
+        for name in SCORE_ELEMENTS:
+            if name in self.changes:
+                patch['score'] = self.changes[name]
+        if 'score' not in patch and self.changes.get('cmi.score.scaled'):
+            patch['score'] = max(float(self.changes['cmi.score.scaled']), 0) * 100
+        return patch
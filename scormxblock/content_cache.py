@@ -0,0 +1,128 @@
+"""
+In-process cache of package files served by proxy_content
+
+Many learners launch the same package at once, all requesting the same
+manifest, player scripts and styles. Small files are kept in memory, least
+recently used first out once the byte budget is spent, and can optionally be
+shared between processes through a Django cache.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_OBJECT_SIZE = 1024 * 1024  # 1 MB
+SHARED_CACHE_KEY_PREFIX = 'scorm_content'
+SHARED_CACHE_TIMEOUT = 24 * 60 * 60  # 1 Day
+
+_content_cache = None
+_content_cache_lock = threading.Lock()
+
+
+class ContentCache(object):
+    """
+    LRU cache of file contents holding at most `max_bytes`, skipping files
+    larger than `max_object_size`. Keys are (block id, package version, path,
+    content hash): the hash keeps packages re-uploaded without versioning apart.
+    """
+    def __init__(self, max_bytes, max_object_size=DEFAULT_MAX_OBJECT_SIZE, shared_cache_alias=None):
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self.shared_cache = caches[shared_cache_alias] if shared_cache_alias else None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def accepts(self, size):
+        return size is not None and size <= self.max_object_size
+
+    def get(self, key):
+        with self._lock:
+            contents = self._entries.pop(key, None)
+            if contents is not None:
+                self._entries[key] = contents
+                self.hits += 1
+                return contents
+            self.misses += 1
+
+        if self.shared_cache is not None:
+            contents = self.shared_cache.get(self._shared_key(key))
+            if contents is not None:
+                self.shared_hits += 1
+                self._add(key, contents)
+        return contents
+
+    def set(self, key, contents):
+        if not self.accepts(len(contents)):
+            return
+        self._add(key, contents)
+        if self.shared_cache is not None:
+            self.shared_cache.set(self._shared_key(key), contents, SHARED_CACHE_TIMEOUT)
+
+    def get_or_read(self, key, read):
+        """
+        Contents cached for `key`, calling `read` to get them on a miss
+        """
+        contents = self.get(key)
+        if contents is None:
+            contents = read()
+            self.set(key, contents)
+        return contents
+
+    def _add(self, key, contents):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = contents
+            self.size += len(contents)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    @staticmethod
+    def _shared_key(key):
+        # memcached keys are limited in length and characters
+        digest = hashlib.md5(u'/'.join(key).encode('utf-8')).hexdigest()
+        return '{}:{}'.format(SHARED_CACHE_KEY_PREFIX, digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_hits': self.shared_hits,
+                'evictions': self.evictions,
+            }
+
+
+def get_content_cache(max_bytes, max_object_size=DEFAULT_MAX_OBJECT_SIZE, shared_cache_alias=None):
+    """
+    The cache shared by all blocks of this process, None when disabled
+    """
+    global _content_cache
+    if not max_bytes:
+        return None
+    with _content_cache_lock:
+        if _content_cache is None:
+            _content_cache = ContentCache(max_bytes, max_object_size, shared_cache_alias)
+        return _content_cache
@@ -0,0 +1,222 @@
+"""
+Node local disk cache of package files served by proxy_content
+
+With packages on remote storage every request for a package file downloads it
+again. Files are copied to a local directory the first time they're requested
+and served from there afterwards, by all processes of the node. The directory
+is kept under a size budget by deleting the least recently used files.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from six.moves import range
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISK_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GB
+COPY_BUFFER_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# don't bump access times of files read more often than this
+TOUCH_INTERVAL = 60  # seconds
+TEMP_FILE_PREFIX = '.tmp-'
+UNVERSIONED_DIR = 'unversioned'
+
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+
+class LocalFileIter(object):
+    """
+    `app_iter` reading bytes `start` to `stop` (exclusive) of a local file
+    through a memory map, without a read buffer of its own
+    """
+    def __init__(self, path, start=0, stop=None, chunk_size=READ_CHUNK_SIZE):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        with open(self.path, 'rb') as local_file:
+            size = os.fstat(local_file.fileno()).st_size
+            stop = size if self.stop is None else min(self.stop, size)
+            if stop <= self.start:
+                return
+            mapped = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in range(self.start, stop, self.chunk_size):
+                    yield mapped[offset:min(offset + self.chunk_size, stop)]
+            finally:
+                mapped.close()
+
+    def app_iter_range(self, start, stop):
+        return LocalFileIter(self.path, start, stop, self.chunk_size)
+
+
+class DiskContentCache(object):
+    """
+    Files cached under `directory`/<block id>/<package version>/, named after a
+    digest of their key (block id, package version, storage key, content hash),
+    so a new package version never gets files of an older one.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_DISK_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # size of the directory when last measured, plus what this process added since
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        block_id, version = key[0], key[1]
+        digest = hashlib.sha1(u'/'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, block_id, version or UNVERSIONED_DIR, digest)
+
+    def get_or_fill(self, key, read_into):
+        """
+        Local path of the file cached for `key`. On a miss `read_into` is called
+        with a file object to write the file's contents to.
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        if stat is not None:
+            self.hits += 1
+            if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+                self._touch(path)
+            return path
+
+        self.misses += 1
+        self._fill(path, read_into)
+        return path
+
+    def _fill(self, path, read_into):
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        # written aside and renamed, so concurrent readers never see part of a file
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                read_into(temp_file)
+            size = os.path.getsize(temp_path)
+            os.rename(temp_path, path)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self._added(size)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self._measure()
+            else:
+                self._size += size
+            if self._size <= self.max_bytes:
+                return
+            self._size = self._evict()
+
+    def _cached_files(self):
+        """
+        (mtime, size, path) of all cached files
+        """
+        files = []
+        for dirpath, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(TEMP_FILE_PREFIX) and time.time() - stat.st_mtime < TOUCH_INTERVAL:
+                    continue  # being written
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _measure(self):
+        return sum(size for _, size, _ in self._cached_files())
+
+    def _evict(self):
+        """
+        Delete the least recently used files until the cache is within budget,
+        leaving room for some more. Returns the size of the cache.
+        """
+        files = sorted(self._cached_files())
+        size = sum(file_size for _, file_size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+            self.evictions += 1
+        logger.info('SCORM disk cache {} evicted down to {} bytes'.format(self.directory, size))
+        return size
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def copy_stored_file(storage, storage_path):
+    """
+    `read_into` callable copying a file from storage
+    """
+    def read_into(target_file):
+        with storage.open(storage_path, 'rb') as stored_file:
+            shutil.copyfileobj(stored_file, target_file, COPY_BUFFER_SIZE)
+    return read_into
+
+
+def get_disk_cache(directory, max_bytes=DEFAULT_DISK_CACHE_SIZE):
+    """
+    The disk cache of `directory` for this process, None when disabled
+    """
+    if not directory:
+        return None
+    with _disk_caches_lock:
+        if directory not in _disk_caches:
+            _disk_caches[directory] = DiskContentCache(directory, max_bytes)
+        return _disk_caches[directory]
@@ -0,0 +1,291 @@
+"""
+Bulk export of learners' SCORM interactions
+
+Writes one row per interaction of every SCO of every learner, with the SCO's
+status, score and times, to a CSV file or to Parquet files. Statuses are
+parsed keeping only the exported keys, optionally by a pool of processes, a
+batch of learners at a time. A checkpoint file records how far the export got,
+so an interrupted export resumes where it stopped.
+"""
+from __future__ import absolute_import
+
+import csv
+import io
+import json
+import os
+import re
+from itertools import islice
+
+import six
+from six.moves import range, zip
+
+from .report_data import BATCH_SIZE_PER_WORKER, process_pool
+from .scorm_state import decode_raw_status
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+
+DEFAULT_PART_ROWS = 100000
+
+# column, then the CMI keys of SCORM 1.2 and 2004 it's read from
+SCO_COLUMNS = [
+    ('lesson_status', ('cmi.core.lesson_status', 'cmi.completion_status')),
+    ('success_status', ('cmi.success_status',)),
+    ('score_raw', ('cmi.core.score.raw', 'cmi.score.raw')),
+    ('score_min', ('cmi.core.score.min', 'cmi.score.min')),
+    ('score_max', ('cmi.core.score.max', 'cmi.score.max')),
+    ('score_scaled', ('cmi.score.scaled',)),
+    ('session_time', ('cmi.core.session_time', 'cmi.session_time')),
+    ('total_time', ('cmi.core.total_time', 'cmi.total_time')),
+]
+# column, then the keys under cmi.interactions.N. it's read from
+INTERACTION_COLUMNS = [
+    ('interaction_id', ('id',)),
+    ('interaction_type', ('type',)),
+    ('description', ('description',)),
+    ('learner_response', ('learner_response', 'student_response')),
+    ('correct_response', ('correct_responses.0.pattern',)),
+    ('result', ('result',)),
+    ('weighting', ('weighting',)),
+    ('latency', ('latency',)),
+    ('timestamp', ('timestamp', 'time')),
+]
+COLUMNS = ['username', 'block_id', 'sco_id'] + [column for column, _ in SCO_COLUMNS] + \
+    ['interaction_index'] + [column for column, _ in INTERACTION_COLUMNS]
+
+SCO_KEYS = frozenset(key for _, keys in SCO_COLUMNS for key in keys)
+INTERACTION_KEY_RE = re.compile(r'^cmi\.interactions\.(\d+)\.({})$'.format(
+    '|'.join(re.escape(key) for _, keys in INTERACTION_COLUMNS for key in keys)
+))
+INTERACTION_COUNT_KEY = 'cmi.interactions._count'
+
+
+def _export_keys_only(pairs):
+    """
+    `object_pairs_hook` keeping the objects of the status and the exported keys
+    """
+    return dict(
+        (key, value) for key, value in pairs
+        if isinstance(value, dict) or key in SCO_KEYS or key == INTERACTION_COUNT_KEY or INTERACTION_KEY_RE.match(key)
+    )
+
+
+def _first_value(data, keys):
+    for key in keys:
+        value = data.get(key)
+        if value is not None:
+            return six.text_type(value)
+    return None
+
+
+def _interactions_count(sco_data):
+    try:
+        return int(sco_data[INTERACTION_COUNT_KEY])
+    except (KeyError, TypeError, ValueError):
+        # players not keeping the count
+        indexes = [int(match.group(1)) for match in map(INTERACTION_KEY_RE.match, sco_data) if match]
+        return max(indexes) + 1 if indexes else 0
+
+
+def status_rows(raw_scorm_status):
+    """
+    Rows of a stored status without the username and block id: one per
+    interaction of every SCO, or one with no interaction for a SCO without any
+    """
+    if not raw_scorm_status:
+        return []
+    raw_status = json.loads(decode_raw_status(raw_scorm_status), object_pairs_hook=_export_keys_only)
+
+    rows = []
+    for sco_id, sco in (raw_status.get('scos') or {}).items():
+        sco_data = sco.get('data') or {}
+        sco_values = (sco_id,) + tuple(_first_value(sco_data, keys) for _, keys in SCO_COLUMNS)
+        count = _interactions_count(sco_data)
+        if not count:
+            rows.append(sco_values + (None,) * (len(INTERACTION_COLUMNS) + 1))
+        for index in range(count):
+            prefix = 'cmi.interactions.{}.'.format(index)
+            rows.append(sco_values + (index,) + tuple(
+                _first_value(sco_data, [prefix + key for key in keys]) for _, keys in INTERACTION_COLUMNS
+            ))
+    return rows
+
+
+class CsvExportWriter(object):
+    """
+    Rows written to a CSV file. `state` of a checkpoint resumes writing
+    after the rows written until then.
+
+    The file is written in binary mode, rows being formatted as CSV in memory
+    first, so the checkpointed offset is a byte offset the file can be
+    truncated at.
+    """
+    def __init__(self, path, state=None):
+        if state is None:
+            self._file = open(path, 'wb')
+            self.write([COLUMNS])
+        else:
+            # drop the rows written after the checkpoint
+            self._file = open(path, 'r+b')
+            self._file.truncate(state['offset'])
+            self._file.seek(state['offset'])
+
+    @staticmethod
+    def _encode(row):
+        row = [u'' if value is None else six.text_type(value) for value in row]
+        if six.PY2:
+            return [value.encode('utf-8') for value in row]
+        return row
+
+    def write(self, rows):
+        rows_csv = io.BytesIO() if six.PY2 else io.StringIO(newline='')
+        csv.writer(rows_csv).writerows(self._encode(row) for row in rows)
+        data = rows_csv.getvalue()
+        self._file.write(data if six.PY2 else data.encode('utf-8'))
+
+    def commit(self):
+        """
+        Writer state to checkpoint, rows written so far are on disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {'offset': self._file.tell()}
+
+    def close(self):
+        state = self.commit()
+        self._file.close()
+        return state
+
+
+class ParquetExportWriter(object):
+    """
+    Rows written to Parquet files `part-<n>.parquet` in a directory, of about
+    `part_rows` rows each
+    """
+    def __init__(self, directory, state=None, part_rows=DEFAULT_PART_ROWS):
+        if pyarrow is None:
+            raise ImportError('Exporting to Parquet requires the pyarrow package')
+        self.directory = directory
+        self.part_rows = part_rows
+        self.part = state['part'] if state else 0
+        self._rows = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, rows):
+        self._rows.extend(rows)
+
+    def _write_part(self):
+        columns = list(zip(*self._rows))
+        schema = pyarrow.schema([
+            (column, pyarrow.int32() if column == 'interaction_index' else pyarrow.string()) for column in COLUMNS
+        ])
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+        )
+        path = os.path.join(self.directory, 'part-{:05d}.parquet'.format(self.part))
+        pyarrow.parquet.write_table(table, path)
+        self.part += 1
+        self._rows = []
+
+    def commit(self):
+        """
+        Writer state to checkpoint once a part was written, else None
+        """
+        if len(self._rows) < self.part_rows:
+            return None
+        self._write_part()
+        return {'part': self.part}
+
+    def close(self):
+        if self._rows:
+            self._write_part()
+        return {'part': self.part}
+
+
+def get_export_writer(export_format, output, state=None):
+    if export_format == CSV_FORMAT:
+        return CsvExportWriter(output, state)
+    if export_format == PARQUET_FORMAT:
+        return ParquetExportWriter(output, state)
+    raise ValueError('Unknown export format {}'.format(export_format))
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    Checkpoint saved at `checkpoint_path`, None if there is none
+    """
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.rename(temp_path, checkpoint_path)
+
+
+def export_interactions(blocks, export_format, output, workers=0, checkpoint_path=None):
+    """
+    Export the interactions of `blocks`, (block id, user state iterator) pairs
+    always listed in the same order. Resumes from the checkpoint at
+    `checkpoint_path` if there is one. Returns the number of rows exported.
+    """
+    checkpoint = load_checkpoint(checkpoint_path) or {}
+    if checkpoint.get('complete'):
+        return checkpoint['rows']
+    if checkpoint and (checkpoint['format'], checkpoint['output']) != (export_format, output):
+        raise ValueError('Checkpoint {} is of another export'.format(checkpoint_path))
+
+    writer = get_export_writer(export_format, output, checkpoint.get('writer'))
+    rows_count = checkpoint.get('rows', 0)
+    pool = process_pool(workers) if workers > 1 else None
+    batch_size = max(workers, 1) * BATCH_SIZE_PER_WORKER
+
+    def checkpointed(block_index, block_id, learners, writer_state, complete=False):
+        if checkpoint_path and writer_state is not None:
+            save_checkpoint(checkpoint_path, {
+                'format': export_format, 'output': output, 'block_index': block_index, 'block_id': block_id,
+                'learners': learners, 'rows': rows_count, 'writer': writer_state, 'complete': complete,
+            })
+
+    try:
+        block_index = block_id = None
+        for block_index, (block_id, user_states) in enumerate(blocks):
+            if block_index < checkpoint.get('block_index', 0):
+                continue
+            learners = 0
+            if block_index == checkpoint.get('block_index'):
+                if block_id != checkpoint['block_id']:
+                    raise ValueError('Blocks changed since checkpoint {}'.format(checkpoint_path))
+                learners = checkpoint['learners']
+            user_states = islice(iter(user_states), learners, None)
+
+            while True:
+                batch = [(user_state.username, user_state.state.get('raw_scorm_status'))
+                         for user_state in islice(user_states, batch_size)]
+                if not batch:
+                    break
+                usernames, statuses = zip(*batch)
+                parsed = pool.map(status_rows, statuses) if pool is not None else map(status_rows, statuses)
+                for username, rows in zip(usernames, parsed):
+                    writer.write((username, block_id) + row for row in rows)
+                    rows_count += len(rows)
+                learners += len(batch)
+                checkpointed(block_index, block_id, learners, writer.commit())
+
+        checkpointed(block_index, block_id, None, writer.close(), complete=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return rows_count
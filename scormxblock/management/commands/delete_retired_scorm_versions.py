@@ -0,0 +1,45 @@
+"""
+Delete the SCORM package versions replaced longer than the grace period ago
+
+Uploads delete them as well, but only those of their own block, so versions
+of blocks that are never uploaded to again stay in storage until this runs.
+
+    ./manage.py lms delete_retired_scorm_versions
+"""
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from scormxblock.scorm_file_uploader import ScormPackageExtractor
+from scormxblock.scormxblock import SCORM_PKG_UPLOAD_WORKERS, SCORM_PKG_VERSION_GRACE_PERIOD, SCORM_STORAGE
+
+VERSIONS_FILE_SUFFIX = '.versions.json'
+
+
+class Command(BaseCommand):
+    help = 'Delete the SCORM package versions replaced longer than the grace period ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-period', type=int, default=SCORM_PKG_VERSION_GRACE_PERIOD,
+                            help='Seconds a replaced version is kept, SCORM_PKG_VERSION_GRACE_PERIOD by default')
+
+    def handle(self, *args, **options):
+        storage = ScormPackageExtractor._get_storage()
+        try:
+            _, file_names = storage.listdir(SCORM_STORAGE)
+        except OSError:
+            # nothing uploaded yet to a file system storage
+            file_names = []
+        deleted = 0
+        for file_name in sorted(file_names):
+            if not file_name.endswith(VERSIONS_FILE_SUFFIX):
+                continue
+            block_id = file_name[:-len(VERSIONS_FILE_SUFFIX)]
+            extractor = ScormPackageExtractor(
+                block_id, None, SCORM_STORAGE, upload_workers=SCORM_PKG_UPLOAD_WORKERS,
+                version_grace_period=options['grace_period']
+            )
+            for version in extractor.delete_retired_versions():
+                self.stdout.write('Deleted version {} of {}'.format(version or '(unversioned)', block_id))
+                deleted += 1
+        self.stdout.write('Deleted {} retired SCORM package versions'.format(deleted))
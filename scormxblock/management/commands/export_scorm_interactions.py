@@ -0,0 +1,65 @@
+"""
+Export the SCORM interactions of every learner in courses
+
+    ./manage.py lms export_scorm_interactions course-v1:Org+Course+Run --output interactions.csv
+"""
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scormxblock.interaction_export import CSV_FORMAT, PARQUET_FORMAT, export_interactions
+
+
+def _user_state_client():
+    try:
+        from lms.djangoapps.courseware.user_state_client import DjangoXBlockUserStateClient
+    except ImportError:
+        from courseware.user_state_client import DjangoXBlockUserStateClient
+    return DjangoXBlockUserStateClient()
+
+
+def course_blocks(course_ids):
+    """
+    (usage id, user state iterator) of the SCORM blocks of the courses, always in the same order
+    """
+    from opaque_keys.edx.keys import CourseKey
+    from xmodule.modulestore.django import modulestore
+
+    client = _user_state_client()
+    store = modulestore()
+    for course_id in course_ids:
+        course_key = CourseKey.from_string(course_id)
+        usage_keys = sorted(
+            (block.location for block in store.get_items(course_key, qualifiers={'category': 'scormxblock'})),
+            key=str
+        )
+        for usage_key in usage_keys:
+            yield str(usage_key), client.iter_all_for_block(usage_key)
+
+
+class Command(BaseCommand):
+    help = 'Export the SCORM interactions, statuses and scores of every learner in courses to CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='+', help='Courses to export')
+        parser.add_argument('--output', required=True,
+                            help='CSV file, or directory of Parquet files, to export to')
+        parser.add_argument('--format', dest='export_format', choices=[CSV_FORMAT, PARQUET_FORMAT],
+                            default=CSV_FORMAT)
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Number of processes parsing learners\' SCORM data')
+        parser.add_argument('--checkpoint',
+                            help='File recording the progress of the export, to resume it after an interruption')
+
+    def handle(self, *args, **options):
+        try:
+            rows = export_interactions(
+                course_blocks(options['course_ids']),
+                options['export_format'],
+                options['output'],
+                workers=options['workers'],
+                checkpoint_path=options['checkpoint'],
+            )
+        except (ImportError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write('Exported {} SCORM interaction rows to {}'.format(rows, options['output']))
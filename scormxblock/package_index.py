@@ -0,0 +1,183 @@
+"""
+Index of the files of a stored SCORM package
+
+The index is written next to the package when it is stored and lists every file
+with its size, MIME type and content hash, so package content can be served
+without asking storage whether a file exists.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import six
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# indexes kept in memory per process
+INDEX_CACHE_SIZE = 256
+# unversioned packages are replaced in place, so their cached index must expire
+UNVERSIONED_INDEX_CACHE_TIMEOUT = 60  # seconds
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_index_path(package_location):
+    return '{}.index.json'.format(package_location)
+
+
+def get_variant_path(package_location, encoding, relative_path):
+    """
+    Storage path of the compressed variant of a package file
+    """
+    return '{}.variants/{}/{}'.format(package_location, encoding, _index_key(relative_path))
+
+
+def get_variants_location(package_location):
+    return '{}.variants'.format(package_location)
+
+
+def guess_content_type(path):
+    ext = os.path.splitext(path)[1]
+    return mimetypes.types_map.get(ext, DEFAULT_CONTENT_TYPE)
+
+
+def _index_key(relative_path):
+    if isinstance(relative_path, six.binary_type):
+        relative_path = relative_path.decode('utf-8')
+    return relative_path.lstrip('/')
+
+
+class PackageIndex(object):
+    """
+    Files of a package stored under `location`, as a dict of path relative
+    to the package to [size, content type, content hash], followed by
+    {encoding: size} for files with compressed variants. Packages stored as
+    a zip at `zip_path` also list [data offset, compressed size, compression
+    method, CRC32] of every member.
+    """
+    def __init__(self, location, files, zip_path=None):
+        self.location = location
+        self.files = files
+        self.zip_path = zip_path
+
+    @classmethod
+    def from_files_to_store(cls, location, files_to_store, zip_path=None):
+        files = {}
+        for file_to_store in files_to_store:
+            path = _index_key(file_to_store['relative_path'])
+            files[path] = [file_to_store['size'], guess_content_type(path), file_to_store['hash']]
+            if file_to_store.get('encodings') or file_to_store.get('zip'):
+                files[path].append(file_to_store.get('encodings') or {})
+            if file_to_store.get('zip'):
+                files[path].append(file_to_store['zip'])
+        return cls(location, files, zip_path)
+
+    def get(self, path):
+        """
+        Entry of the file at `path` as a dict with its size, content type,
+        hash, storage key and compressed variants, None if the package has no such file
+        """
+        entry = self.files.get(_index_key(path))
+        if entry is None:
+            return None
+        zip_member = None
+        if len(entry) > 4:
+            offset, compressed_size, method, crc = entry[4]
+            zip_member = {
+                'offset': offset, 'compressed_size': compressed_size, 'method': method, 'crc': crc, 'size': entry[0]
+            }
+        return {
+            'size': entry[0],
+            'content_type': entry[1],
+            'hash': entry[2],
+            'key': '{}/{}'.format(self.location, _index_key(path)),
+            'encodings': entry[3] if len(entry) > 3 else {},
+            'zip': zip_member,
+        }
+
+    def variant(self, path, encoding):
+        """
+        Storage path and size of the `encoding` variant of the file at `path`
+        """
+        entry = self.get(path)
+        if entry is None or encoding not in entry['encodings']:
+            return None
+        return get_variant_path(self.location, encoding, path), entry['encodings'][encoding]
+
+    def __contains__(self, path):
+        return _index_key(path) in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def to_json(self):
+        index = {'location': self.location, 'files': self.files}
+        if self.zip_path:
+            index['zip'] = self.zip_path
+        return json.dumps(index, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data):
+        index = json.loads(data)
+        return cls(index['location'], index['files'], index.get('zip'))
+
+    def save(self, storage):
+        path = get_index_path(self.location)
+        storage.delete(path)
+        storage.save(path, ContentFile(self.to_json().encode('utf-8')))
+
+
+def delete_package_index(storage, package_location):
+    try:
+        storage.delete(get_index_path(package_location))
+    except Exception:
+        pass
+
+
+def load_package_index(storage, package_location):
+    """
+    Read the index of the package stored under `package_location`,
+    None for packages stored without one
+    """
+    path = get_index_path(package_location)
+    try:
+        with storage.open(path, 'rb') as index_file:
+            return PackageIndex.from_json(index_file.read().decode('utf-8'))
+    except Exception as e:
+        # a missing file surfaces as a backend specific error on remote storage
+        logger.debug('SCORM package index {} could not be read: {}'.format(path, e))
+        return None
+
+
+def get_package_index(storage, package_location, versioned=True):
+    """
+    Index of the package stored under `package_location`, read from storage once
+    per process. A versioned package never changes, so its index is kept until
+    evicted; the index of an unversioned one is re-read after a short while.
+    """
+    now = time.time()
+    with _index_cache_lock:
+        cached = _index_cache.get(package_location)
+        if cached is not None:
+            index, expires_at = cached
+            if expires_at is None or expires_at > now:
+                _index_cache[package_location] = _index_cache.pop(package_location)
+                return index
+
+    index = load_package_index(storage, package_location)
+    expires_at = None if versioned else now + UNVERSIONED_INDEX_CACHE_TIMEOUT
+    with _index_cache_lock:
+        _index_cache[package_location] = (index, expires_at)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
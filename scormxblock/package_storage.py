@@ -0,0 +1,247 @@
+"""
+Bulk operations on stored SCORM package files
+
+Django's storage API works one file at a time, which means one round trip per
+file on remote storage. These wrappers add listing, bulk deletes and copies of
+whole package directories, and ranged reads of single files, using the
+backend's batch and range operations where it has them.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
+
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+# S3 multi-object delete takes at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+
+# threads deleting files on backends without a bulk delete
+DEFAULT_DELETE_WORKERS = 8
+
+RANGE_READ_CHUNK_SIZE = 64 * 1024
+
+
+def _read_chunks(fh, length):
+    remaining = length
+    while remaining > 0:
+        chunk = fh.read(min(RANGE_READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class PackageStorage(object):
+    """
+    Works with any Django storage: walks directories with `listdir` and
+    deletes files in parallel, one request per file
+    """
+    def __init__(self, storage, delete_workers=DEFAULT_DELETE_WORKERS):
+        self.storage = storage
+        self.delete_workers = max(int(delete_workers), 1)
+
+    def list_files(self, location):
+        """
+        Storage paths of all files under `location`, recursively
+        """
+        try:
+            dirs, files = self.storage.listdir(location)
+        except OSError:
+            return []
+
+        paths = [os.path.join(location, name) for name in files]
+        for name in dirs:
+            paths.extend(self.list_files(os.path.join(location, name)))
+        return paths
+
+    def bulk_delete(self, paths):
+        """
+        Delete the files at `paths`, returns the number of files deleted
+        """
+        paths = list(paths)
+        workers = min(self.delete_workers, len(paths))
+        if workers <= 1:
+            for path in paths:
+                self.storage.delete(path)
+            return len(paths)
+
+        pool = ThreadPool(workers)
+        try:
+            pool.map(self.storage.delete, paths)
+        finally:
+            pool.terminate()
+            pool.join()
+        return len(paths)
+
+    def delete_dir(self, location):
+        """
+        Delete everything under `location`
+        """
+        return self.bulk_delete(self.list_files(location))
+
+    def copy(self, source_path, target_path):
+        with self.storage.open(source_path, 'rb') as source_file:
+            self.storage.save(target_path, source_file)
+
+    def signed_url(self, path, expires_in):
+        """
+        URL giving access to the stored file for `expires_in` seconds,
+        None if the backend can't sign URLs
+        """
+        return None
+
+    def read_range(self, path, start, stop):
+        """
+        Yield bytes `start` to `stop` (exclusive) of the stored file in chunks
+        """
+        with self.storage.open(path, 'rb') as stored_file:
+            stored_file.seek(start)
+            for chunk in _read_chunks(stored_file, stop - start):
+                yield chunk
+
+
+class FileSystemPackageStorage(PackageStorage):
+    """
+    Local file system storage, works on the files directly
+    """
+    def list_files(self, location):
+        root = self.storage.path(location)
+        paths = []
+        for dirpath, _, files in os.walk(root):
+            relative_dir = os.path.relpath(dirpath, self.storage.location)
+            paths.extend(os.path.join(relative_dir, name) for name in files)
+        return paths
+
+    def bulk_delete(self, paths):
+        deleted = 0
+        for path in paths:
+            try:
+                os.remove(self.storage.path(path))
+                deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+    def delete_dir(self, location):
+        root = self.storage.path(location)
+        deleted = sum(len(files) for _, _, files in os.walk(root))
+        shutil.rmtree(root, ignore_errors=True)
+        return deleted
+
+    def copy(self, source_path, target_path):
+        target = self.storage.path(target_path)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copyfile(self.storage.path(source_path), target)
+
+
+class S3BotoPackageStorage(PackageStorage):
+    """
+    `storages.backends.s3boto.S3BotoStorage`: prefix listing, multi-object
+    deletes in batches of 1000 keys and server side copies
+    """
+    def _key_name(self, path):
+        return self.storage._normalize_name(self.storage._clean_name(path))
+
+    def _storage_path(self, key_name):
+        location = (self.storage.location or '').strip('/')
+        if location and key_name.startswith(location + '/'):
+            return key_name[len(location) + 1:]
+        return key_name
+
+    def list_files(self, location):
+        prefix = self._key_name(location).rstrip('/') + '/'
+        return [self._storage_path(key.name) for key in self.storage.bucket.list(prefix=prefix)]
+
+    def bulk_delete(self, paths):
+        key_names = [self._key_name(path) for path in paths]
+        for batch in _batches(key_names, S3_DELETE_BATCH_SIZE):
+            result = self.storage.bucket.delete_keys(batch, quiet=True)
+            for error in getattr(result, 'errors', []):
+                logger.warning('Could not delete {} from S3: {}'.format(error.key, error.message))
+        return len(key_names)
+
+    def delete_dir(self, location):
+        return self.bulk_delete(self.list_files(location))
+
+    def copy(self, source_path, target_path):
+        bucket = self.storage.bucket
+        bucket.copy_key(self._key_name(target_path), bucket.name, self._key_name(source_path))
+
+    def signed_url(self, path, expires_in):
+        return self.storage.connection.generate_url(
+            expires_in, 'GET', bucket=self.storage.bucket.name, key=self._key_name(path),
+            query_auth=True, force_http=not self.storage.secure_urls
+        )
+
+    def read_range(self, path, start, stop):
+        # a ranged GET, the storage's files download the whole object first
+        key = self.storage.bucket.new_key(self._key_name(path))
+        key.open_read(headers={'Range': 'bytes={}-{}'.format(start, stop - 1)})
+        try:
+            for chunk in _read_chunks(key, stop - start):
+                yield chunk
+        finally:
+            key.close()
+
+
+class S3Boto3PackageStorage(S3BotoPackageStorage):
+    """
+    `storages.backends.s3boto3.S3Boto3Storage`, same operations through boto3
+    """
+    def list_files(self, location):
+        prefix = self._key_name(location).rstrip('/') + '/'
+        return [self._storage_path(obj.key) for obj in self.storage.bucket.objects.filter(Prefix=prefix)]
+
+    def bulk_delete(self, paths):
+        key_names = [self._key_name(path) for path in paths]
+        for batch in _batches(key_names, S3_DELETE_BATCH_SIZE):
+            result = self.storage.bucket.delete_objects(
+                Delete={'Objects': [{'Key': key_name} for key_name in batch], 'Quiet': True}
+            )
+            for error in result.get('Errors', []):
+                logger.warning('Could not delete {} from S3: {}'.format(error.get('Key'), error.get('Message')))
+        return len(key_names)
+
+    def copy(self, source_path, target_path):
+        bucket = self.storage.bucket
+        bucket.copy({'Bucket': bucket.name, 'Key': self._key_name(source_path)}, self._key_name(target_path))
+
+    def signed_url(self, path, expires_in):
+        bucket = self.storage.bucket
+        return bucket.meta.client.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket.name, 'Key': self._key_name(path)}, ExpiresIn=expires_in
+        )
+
+    def read_range(self, path, start, stop):
+        stored_object = self.storage.bucket.Object(self._key_name(path))
+        body = stored_object.get(Range='bytes={}-{}'.format(start, stop - 1))['Body']
+        try:
+            for chunk in _read_chunks(body, stop - start):
+                yield chunk
+        finally:
+            body.close()
+
+
+def get_package_storage(storage, delete_workers=DEFAULT_DELETE_WORKERS):
+    """
+    Wrap a Django storage with the package operations its backend supports best
+    """
+    bucket = getattr(storage, 'bucket', None)
+    if bucket is not None and hasattr(bucket, 'delete_objects'):
+        return S3Boto3PackageStorage(storage, delete_workers)
+    if bucket is not None and hasattr(bucket, 'delete_keys'):
+        return S3BotoPackageStorage(storage, delete_workers)
+    if isinstance(storage, FileSystemStorage):
+        return FileSystemPackageStorage(storage, delete_workers)
+    return PackageStorage(storage, delete_workers)
@@ -0,0 +1,108 @@
+"""
+Compressed variants of package text files
+
+HTML, scripts, styles and data files of a package are compressed once when the
+package is stored, so proxy_content can send them compressed without spending
+CPU on every request.
+"""
+from __future__ import absolute_import
+
+import gzip
+import io
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_ENCODING = 'gzip'
+BROTLI_ENCODING = 'br'
+
+DEFAULT_PRECOMPRESS_MIN_SIZE = 1024
+DEFAULT_PRECOMPRESS_TYPES = [
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+]
+
+# a variant is only kept if it saves at least this share of the file
+MIN_COMPRESSION_SAVING = 0.1
+
+ACCEPT_ENCODING_RE = re.compile(r"^\s*(?P<coding>[\w*-]+)\s*(?:;\s*q\s*=\s*(?P<q>[0-9.]+))?\s*$")
+
+
+def _gzip(contents):
+    buf = io.BytesIO()
+    # fixed mtime, so the same file always gets the same variant
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as gzip_file:
+        gzip_file.write(contents)
+    return buf.getvalue()
+
+
+def _brotli(contents):
+    return brotli.compress(contents)
+
+
+def available_encodings():
+    """
+    Encodings variants are made for, in order of preference
+    """
+    if brotli is not None:
+        return [BROTLI_ENCODING, GZIP_ENCODING]
+    return [GZIP_ENCODING]
+
+
+def is_compressible(content_type, size, min_size=DEFAULT_PRECOMPRESS_MIN_SIZE, content_types=None):
+    if content_types is None:
+        content_types = DEFAULT_PRECOMPRESS_TYPES
+    return size >= min_size and content_type in content_types
+
+
+def compress_variants(contents):
+    """
+    Compressed variants of `contents` worth keeping, as a dict of encoding to bytes
+    """
+    compressors = {GZIP_ENCODING: _gzip, BROTLI_ENCODING: _brotli}
+    variants = {}
+    for encoding in available_encodings():
+        compressed = compressors[encoding](contents)
+        if len(compressed) <= len(contents) * (1 - MIN_COMPRESSION_SAVING):
+            variants[encoding] = compressed
+    return variants
+
+
+def choose_encoding(accept_encoding, encodings):
+    """
+    Best of the available `encodings` for an Accept-Encoding header,
+    None to send the file as it is
+    """
+    if not accept_encoding or not encodings:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        matches = ACCEPT_ENCODING_RE.match(part)
+        if not matches:
+            continue
+        try:
+            q = float(matches.group('q')) if matches.group('q') is not None else 1.0
+        except ValueError:
+            continue
+        accepted[matches.group('coding').lower()] = q
+
+    best, best_q = None, 0
+    for encoding in [BROTLI_ENCODING, GZIP_ENCODING]:
+        if encoding not in encodings:
+            continue
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
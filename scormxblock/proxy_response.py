@@ -0,0 +1,130 @@
+"""
+Responses streaming stored SCORM package files
+
+Files are read from storage in chunks as the response body is read. Range
+requests get the requested bytes only, and files with a known content hash
+can be revalidated with their ETag.
+
+The LMS turns a handler's response into a Django HttpResponse with
+`webob_to_django_response`, without streaming, which joins the whole body in
+memory before sending it. Large files are redirected to signed URLs instead,
+see `ScormXBlock._signed_redirect_url`.
+"""
+from __future__ import absolute_import
+
+from webob import Response
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_CACHE_MAX_AGE = 60 * 60  # 1 Hour
+
+
+class StorageFileIter(object):
+    """
+    `app_iter` reading bytes `start` to `stop` (exclusive) of a stored file.
+    The file is only opened once the response body is read.
+    """
+    def __init__(self, storage, path, start=0, stop=None, chunk_size=STREAM_CHUNK_SIZE):
+        self.storage = storage
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        with self.storage.open(self.path, 'rb') as stored_file:
+            if self.start:
+                stored_file.seek(self.start)
+            remaining = None if self.stop is None else self.stop - self.start
+            while remaining is None or remaining > 0:
+                read_size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                chunk = stored_file.read(read_size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def app_iter_range(self, start, stop):
+        return StorageFileIter(self.storage, self.path, start, stop, self.chunk_size)
+
+
+class BytesIter(object):
+    """
+    `app_iter` of contents already in memory
+    """
+    def __init__(self, contents):
+        self.contents = contents
+
+    def __iter__(self):
+        yield self.contents
+
+    def app_iter_range(self, start, stop):
+        return BytesIter(self.contents[start:stop])
+
+
+def stored_file_response(request, storage, path, content_type, size=None, etag=None,
+                         cache_max_age=DEFAULT_CACHE_MAX_AGE, headers=None):
+    """
+    Stream the stored file at `path`. With its `size` and `etag` known the
+    response answers conditional (304) and byte range (206, 416) requests.
+    """
+    return content_response(
+        request, StorageFileIter(storage, path), content_type, size=size, etag=etag, cache_max_age=cache_max_age,
+        headers=headers
+    )
+
+
+def cached_content_response(request, contents, content_type, etag=None, cache_max_age=DEFAULT_CACHE_MAX_AGE,
+                            headers=None):
+    """
+    Same as `stored_file_response`, for file contents held in memory
+    """
+    return content_response(
+        request, BytesIter(contents), content_type, size=len(contents), etag=etag, cache_max_age=cache_max_age,
+        headers=headers
+    )
+
+
+def content_response(request, app_iter, content_type, size=None, etag=None, cache_max_age=DEFAULT_CACHE_MAX_AGE,
+                     headers=None):
+    """
+    Response sending `app_iter`, which must support `app_iter_range`
+    """
+    response = Response(content_type=content_type, conditional_response=False)
+    response.app_iter = app_iter
+    if headers:
+        response.headers.update(headers)
+    # package content is only served to enrolled learners
+    response.cache_control.private = True
+    response.cache_control.max_age = cache_max_age
+    if etag:
+        response.etag = etag
+    if size is None:
+        return response
+
+    response.content_length = size
+    response.accept_ranges = 'bytes'
+
+    if etag and etag in request.if_none_match:
+        response.status = 304
+        response.app_iter = []
+        del response.content_length
+        return response
+
+    if request.range and (not request.if_range or response in request.if_range):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response.status = 416
+            response.app_iter = []
+            response.content_length = 0
+            response.content_range = 'bytes */{}'.format(size)
+            return response
+
+        start, stop = byte_range
+        response.status = 206
+        response.app_iter = response.app_iter.app_iter_range(start, stop)
+        response.content_length = stop - start
+        response.content_range = (start, stop, size)
+
+    return response
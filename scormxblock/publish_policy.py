@@ -0,0 +1,54 @@
+"""
+When to publish grades and completion
+
+SCO players commit their status every few seconds, and every grade or
+completion event published makes the LMS recalculate the course grade. The
+block remembers what it last published and, depending on the policy, skips
+publishing the same value again.
+"""
+from __future__ import absolute_import
+
+import threading
+
+PUBLISH_ALWAYS = 'always'
+PUBLISH_CHANGED = 'changed'
+PUBLISH_IMPROVED = 'improved'
+PUBLISH_POLICIES = (PUBLISH_ALWAYS, PUBLISH_CHANGED, PUBLISH_IMPROVED)
+
+
+def should_publish(policy, last_value, value):
+    """
+    Whether to publish `value` when `last_value` was published last, None if nothing was
+    """
+    if policy == PUBLISH_ALWAYS or last_value is None:
+        return True
+    if policy == PUBLISH_IMPROVED:
+        return value > last_value
+    return value != last_value
+
+
+class PublishCounters(object):
+    """
+    Published and skipped events of this process, by event type
+    """
+    def __init__(self):
+        self.published = {}
+        self.skipped = {}
+        self._lock = threading.Lock()
+
+    def record(self, event_type, published):
+        counts = self.published if published else self.skipped
+        with self._lock:
+            counts[event_type] = counts.get(event_type, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {'published': dict(self.published), 'skipped': dict(self.skipped)}
+
+    def clear(self):
+        with self._lock:
+            self.published.clear()
+            self.skipped.clear()
+
+
+publish_counters = PublishCounters()
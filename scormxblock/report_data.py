@@ -0,0 +1,90 @@
+"""
+Interaction rows of the instructor's student responses report
+
+Only a few `cmi.interactions.N.*` keys of every learner's SCORM status make it
+to the report. The status is parsed keeping just those keys, so the rest of it
+is freed as soon as it's read, and the parsing can be spread over a pool of
+processes for courses with many learners.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import multiprocessing
+import re
+from itertools import islice
+
+from six.moves import range, zip
+
+from .scorm_state import decode_raw_status
+
+logger = logging.getLogger(__name__)
+
+REPORT_KEY_RE = re.compile(r'^cmi\.interactions\.(_count|\d+\.(description|learner_response))$')
+# learners parsed by each worker process in a round
+BATCH_SIZE_PER_WORKER = 256
+
+
+def _report_keys_only(pairs):
+    """
+    `object_pairs_hook` keeping the objects of the status and the keys of the report
+    """
+    return dict((key, value) for key, value in pairs if isinstance(value, dict) or REPORT_KEY_RE.match(key))
+
+
+def user_interactions(raw_scorm_status):
+    """
+    (question, answer, interactions count) of every interaction in a stored status
+    """
+    if not raw_scorm_status:
+        return []
+    raw_status = json.loads(decode_raw_status(raw_scorm_status), object_pairs_hook=_report_keys_only)
+
+    rows = []
+    for sco in (raw_status.get('scos') or {}).values():
+        sco_data = sco.get('data') or {}
+        interactions_count = sco_data.get('cmi.interactions._count', 0)
+        for interaction_index in range(interactions_count):
+            prefix = 'cmi.interactions.{}.'.format(interaction_index)
+            rows.append((sco_data.get(prefix + 'description'), sco_data.get(prefix + 'learner_response'),
+                         interactions_count))
+    return rows
+
+
+def process_pool(workers):
+    """
+    Pool of `workers` processes to parse statuses in, None if processes can't be started
+    """
+    try:
+        return multiprocessing.Pool(workers)
+    except (AssertionError, OSError) as e:
+        # e.g. in a daemonic Celery worker process, which can't have children
+        logger.warning('Parsing SCORM data in process, no process pool: {}'.format(e))
+        return None
+
+
+def iter_user_interactions(user_state_iterator, workers=0):
+    """
+    (username, rows of user_interactions) of every user state, in order.
+    With `workers` the statuses are parsed by a pool of that many processes,
+    a batch at a time so only a few of them are held in memory.
+    """
+    pool = process_pool(workers) if workers > 1 else None
+    if pool is None:
+        for user_state in user_state_iterator:
+            yield user_state.username, user_interactions(user_state.state.get('raw_scorm_status'))
+        return
+
+    user_state_iterator = iter(user_state_iterator)
+    try:
+        while True:
+            batch = [(user_state.username, user_state.state.get('raw_scorm_status'))
+                     for user_state in islice(user_state_iterator, workers * BATCH_SIZE_PER_WORKER)]
+            if not batch:
+                break
+            usernames, statuses = zip(*batch)
+            for username, rows in zip(usernames, pool.map(user_interactions, statuses)):
+                yield username, rows
+    finally:
+        pool.terminate()
+        pool.join()
@@ -2,25 +2,87 @@ from __future__ import absolute_import
 
 import logging
 import os
+import hashlib
+import json
 import re
 import shutil
 import tempfile
+import threading
+import time
+import uuid
 import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
+import six
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage, get_storage_class
 from django.utils import encoding
 
+from .chunk_store import (
+    DEFAULT_CHUNK_STORAGE_DIR,
+    LOCAL_CHUNK_STORE,
+    IncompleteUploadError,
+    covers,
+    get_chunk_store
+)
+from .package_index import (
+    PackageIndex,
+    delete_package_index,
+    get_variant_path,
+    get_variants_location,
+    guess_content_type,
+    load_package_index
+)
+from .package_storage import get_package_storage
+from .precompress import (
+    BROTLI_ENCODING,
+    DEFAULT_PRECOMPRESS_MIN_SIZE,
+    GZIP_ENCODING,
+    compress_variants,
+    is_compressible
+)
+from .zip_package import FILES_STORAGE_MODE, ZIP_STORAGE_MODE, get_zip_path, is_servable, member_data_offset
+
 logger = logging.getLogger(__name__)
 
 # Regex to capture Content-Range header ranges.
 # e.g; "bytes 0-19999999/69221159"
 CONTENT_RE = re.compile(r"(?P<start>\d{1,11})-(?P<end>\d{1,11})/(?P<size>\d{1,11})")
 
+# Regex to capture the chunk checksum header sent by Studio.
+# e.g; "sha256=9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+CHECKSUM_RE = re.compile(r"^(?P<algorithm>sha256|sha1|md5)=(?P<digest>[0-9a-fA-F]+)$")
+
 # upload progress cache key expiry
 PROGRESS_CACHE_EXPIRY = 1 * 60 * 60  # 1 Hour
 
+# defaults for storing extracted package files
+DEFAULT_UPLOAD_WORKERS = 1
+DEFAULT_UPLOAD_MAX_RETRIES = 3
+DEFAULT_UPLOAD_RETRY_BACKOFF = 1  # seconds, doubled after every failed attempt
+
+# zip members that can't be rewound are spooled to memory up to this size, to disk above it
+STREAM_SPOOL_MAX_SIZE = 10 * 1024 * 1024  # 10 MB
+
+# general purpose flag bit telling the member name is UTF-8 encoded
+ZIP_UTF8_FLAG = 0x800
+
+# read size used when hashing extracted files
+HASH_CHUNK_SIZE = 64 * 1024
+
+# package versions are stored under <storage dir>/<block id>/<version>/
+# e.g; "20201018142501-9f86d081"
+VERSION_RE = re.compile(r"^\d{14}-[0-9a-f]{8}$")
+
+# how long a replaced package version stays in storage for learners still using it
+DEFAULT_VERSION_GRACE_PERIOD = 24 * 60 * 60  # 1 Day
+
 
 class FileAccessMode:
     WRITE = "wb+"
@@ -34,58 +96,297 @@ class STATE:
     """
     PROGRESS = 'progress'
     COMPLETE = 'complete'
+    QUEUED = 'queued'
+
+
+class PHASE:
+    """
+    enum for the phases of processing an uploaded package
+    """
+    UPLOADING = 'uploading'
+    RECEIVED = 'received'
+    EXTRACTING = 'extracting'
+    STORING = 'storing'
+    PUBLISHING = 'publishing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class ChunkIntegrityError(Exception):
+    """
+    A chunk didn't arrive as sent: its length or checksum doesn't match
+    """
+    def __init__(self, message):
+        super(ChunkIntegrityError, self).__init__(message)
+        self.message = message
 
 
 class ScormPackageUploader:
     """
     Handles scorm package uploading
     """
-    def __init__(self, request, xblock, scorm_storage_location):
+    def __init__(self, request, xblock, scorm_storage_location,
+                 upload_workers=DEFAULT_UPLOAD_WORKERS,
+                 upload_max_retries=DEFAULT_UPLOAD_MAX_RETRIES,
+                 upload_retry_backoff=DEFAULT_UPLOAD_RETRY_BACKOFF,
+                 stream_extract=False,
+                 deduplicate=False,
+                 chunk_store_type=LOCAL_CHUNK_STORE,
+                 chunk_storage_location=DEFAULT_CHUNK_STORAGE_DIR,
+                 versioned=False,
+                 version_grace_period=DEFAULT_VERSION_GRACE_PERIOD,
+                 precompress=False,
+                 precompress_min_size=DEFAULT_PRECOMPRESS_MIN_SIZE,
+                 precompress_types=None,
+                 storage_mode=FILES_STORAGE_MODE,
+                 job_backend=None):
         self.xblock = xblock
         self.request = request
         self.scorm_file = request.params['scorm_file'].file
-        self.temp_file_path = os.path.join(tempfile.gettempdir(), xblock.location.block_id)
-        self.scorm_storage_location = os.path.join(scorm_storage_location, xblock.location.block_id)
+        self.scorm_file_name = getattr(request.params['scorm_file'], 'filename', '')
+        self.block_id = xblock.location.block_id
+        self.chunk_store = get_chunk_store(
+            chunk_store_type, self.block_id, ScormPackageExtractor._get_storage(), chunk_storage_location
+        )
+        self.job_backend = job_backend
+        # plain values only: these are sent as they are to the background job processing the package
+        self.extractor_kwargs = {
+            'block_id': self.block_id,
+            'package_encoding': xblock.encoding,
+            'scorm_storage_location': scorm_storage_location,
+            'upload_workers': upload_workers,
+            'upload_max_retries': upload_max_retries,
+            'upload_retry_backoff': upload_retry_backoff,
+            'stream_extract': stream_extract,
+            'deduplicate': deduplicate,
+            'chunk_store_type': chunk_store_type,
+            'chunk_storage_location': chunk_storage_location,
+            'versioned': versioned,
+            'current_version': xblock.package_version if xblock.scorm_file else None,
+            'version_grace_period': version_grace_period,
+            'precompress': precompress,
+            'precompress_min_size': precompress_min_size,
+            'precompress_types': precompress_types,
+            'storage_mode': storage_mode,
+        }
 
     def upload(self):
         content_range = self._get_content_range()
-        mode = FileAccessMode.WRITE if int(content_range['start']) == 0 else FileAccessMode.APPEND
-
-        self._write_to_file(mode=mode)
+        start, end = int(content_range['start']), int(content_range['end'])
+
+        self._verify_chunk(content_range)
+        self.chunk_store.begin(self.get_upload_key(self.scorm_file_name, content_range['size']))
+        self.chunk_store.write_chunk(start, end, self.scorm_file)
+        # every accepted chunk replaces the phase, e.g. the failure of an interrupted upload being resumed
+        last_chunk = end == int(content_range['size']) - 1
+        ScormPackageUploader.set_upload_phase(self.block_id, PHASE.RECEIVED if last_chunk else PHASE.UPLOADING)
         return self._upload_state(content_range)
 
+    def _verify_chunk(self, content_range):
+        """
+        Check the chunk against its Content-Range length and
+        the optional `X-Chunk-Checksum` header before writing it
+        """
+        checksum = CHECKSUM_RE.match(self.request.headers.get('X-Chunk-Checksum', ''))
+        hasher = hashlib.new(checksum.group('algorithm')) if checksum else None
+
+        length = 0
+        for chunk in self.scorm_file.chunks():
+            length += len(chunk)
+            if hasher:
+                hasher.update(chunk)
+
+        if not content_range.get('single_chunk'):
+            expected_length = int(content_range['end']) - int(content_range['start']) + 1
+            if length != expected_length:
+                raise ChunkIntegrityError(
+                    'Chunk {start}-{end} is {length} bytes long, expected {expected}'.format(
+                        length=length, expected=expected_length, **content_range
+                    )
+                )
+        if hasher and hasher.hexdigest() != checksum.group('digest').lower():
+            raise ChunkIntegrityError('Chunk {start}-{end} failed its checksum'.format(**content_range))
+
     def _get_content_range(self):
         try:
             matches = CONTENT_RE.search(self.request.headers['Content-Range'])
             content_range = matches.groupdict()
         except KeyError:  # Single chunk
             # no Content-Range header, so make one that will work
-            content_range = {'start': 0, 'end': 1, 'size': 2}
+            content_range = {'start': 0, 'end': 1, 'size': 2, 'single_chunk': True}
 
         return content_range
 
     def _upload_state(self, content_range):
-        size = os.path.getsize(self.temp_file_path)
-
         if int(content_range['end']) != int(content_range['size']) - 1:
-            # More chunks coming
-            return STATE.PROGRESS, size
-        else:
-            # upload complete, extract and store
-            scorm_file_url = self._extract_and_store()
-            return STATE.COMPLETE, scorm_file_url
+            # More chunks coming, tell where to resume from
+            return STATE.PROGRESS, self.chunk_store.uploaded_bytes()
+
+        # upload complete, assemble, extract and store
+        size = None if content_range.get('single_chunk') else int(content_range['size'])
+        if self.job_backend is None:
+            package_fields = ScormPackageExtractor(**self.extractor_kwargs).extract_and_store(size)
+            return STATE.COMPLETE, package_fields
+
+        if size is not None and not covers(self.chunk_store.received_ranges(), size):
+            raise IncompleteUploadError(
+                'Upload incomplete: received {} of {} bytes'.format(self.chunk_store.received_size(), size)
+            )
+        self.job_backend.enqueue(
+            six.text_type(self.xblock.location), self.xblock.scope_ids.user_id, self.extractor_kwargs, size
+        )
+        return STATE.QUEUED, None
+
+    @staticmethod
+    def get_upload_key(file_name, size):
+        """
+        Identifies an upload, so chunks of different packages are never mixed up
+        """
+        return u'{}:{}'.format(file_name, size)
+
+    @staticmethod
+    def get_uploaded_bytes(block_id, file_name, size,
+                           chunk_store_type=LOCAL_CHUNK_STORE,
+                           chunk_storage_location=DEFAULT_CHUNK_STORAGE_DIR):
+        """
+        Number of bytes of the package the upload can resume from, 0 if it's a new upload
+        """
+        chunk_store = get_chunk_store(
+            chunk_store_type, block_id, ScormPackageExtractor._get_storage(), chunk_storage_location
+        )
+        return chunk_store.uploaded_bytes(ScormPackageUploader.get_upload_key(file_name, size))
+
+    @staticmethod
+    def _get_progress_cache_key(block_id):
+        return 'upload_percent_{}'.format(block_id)
+
+    @staticmethod
+    def get_upload_percentage(block_id):
+        cache_key = ScormPackageUploader._get_progress_cache_key(block_id)
+        return cache.get(cache_key, 100)
+
+    @staticmethod
+    def clear_percentage_cache(block_id):
+        cache_key = ScormPackageUploader._get_progress_cache_key(block_id)
+        cache.delete(cache_key)
+
+    @staticmethod
+    def _get_status_cache_key(block_id):
+        return 'upload_status_{}'.format(block_id)
+
+    @staticmethod
+    def set_upload_phase(block_id, phase, error=None):
+        cache_key = ScormPackageUploader._get_status_cache_key(block_id)
+        cache.set(cache_key, {'phase': phase, 'error': error}, PROGRESS_CACHE_EXPIRY)
+
+    @staticmethod
+    def get_upload_status(block_id):
+        """
+        Phase of processing the uploaded package, its percentage and error if any
+        """
+        cache_key = ScormPackageUploader._get_status_cache_key(block_id)
+        status = cache.get(cache_key) or {'phase': None, 'error': None}
+        status['progress'] = ScormPackageUploader.get_upload_percentage(block_id)
+        return status
+
+
+class ScormPackageExtractor:
+    """
+    Extracts an uploaded scorm package and stores its files
+    """
+    def __init__(self, block_id, package_encoding, scorm_storage_location,
+                 upload_workers=DEFAULT_UPLOAD_WORKERS,
+                 upload_max_retries=DEFAULT_UPLOAD_MAX_RETRIES,
+                 upload_retry_backoff=DEFAULT_UPLOAD_RETRY_BACKOFF,
+                 stream_extract=False,
+                 deduplicate=False,
+                 chunk_store_type=LOCAL_CHUNK_STORE,
+                 chunk_storage_location=DEFAULT_CHUNK_STORAGE_DIR,
+                 versioned=False,
+                 current_version=None,
+                 version_grace_period=DEFAULT_VERSION_GRACE_PERIOD,
+                 precompress=False,
+                 precompress_min_size=DEFAULT_PRECOMPRESS_MIN_SIZE,
+                 precompress_types=None,
+                 storage_mode=FILES_STORAGE_MODE):
+        self.block_id = block_id
+        self.package_encoding = package_encoding
+        self.temp_file_path = os.path.join(tempfile.gettempdir(), block_id)
+        self.block_storage_location = os.path.join(scorm_storage_location, block_id)
+        self.versioned = versioned
+        # version of the package published before this upload, '' if it isn't versioned
+        self.current_version = current_version
+        self.version_grace_period = version_grace_period
+        self.version = self._new_version() if versioned else ''
+        self.scorm_storage_location = self._version_location(self.version)
+        self.versions_path = '{}.versions.json'.format(self.block_storage_location)
+        self.upload_workers = max(int(upload_workers), 1)
+        self.upload_max_retries = max(int(upload_max_retries), 0)
+        self.upload_retry_backoff = upload_retry_backoff
+        self.stream_extract = stream_extract
+        self.deduplicate = deduplicate
+        self.precompress = precompress
+        self.precompress_min_size = precompress_min_size
+        self.precompress_types = precompress_types
+        self.storage_mode = storage_mode
+        self.manifest_path = '{}.manifest.json'.format(self.block_storage_location)
+        self.chunk_store = get_chunk_store(chunk_store_type, block_id, self._get_storage(), chunk_storage_location)
+        # storage backends and zip handles aren't guaranteed to be thread safe, so every worker gets its own
+        self._thread_local = threading.local()
+        self._zip_files = []
+        self._zip_files_lock = threading.Lock()
+
+    def extract_and_store(self, size=None):
+        """
+        Assemble the uploaded package, extract and store it.
+        Returns the field values of the block to publish it.
+        """
+        self.chunk_store.assemble(self.temp_file_path, size)
+        scorm_file_url = self._extract_and_store()
+        # publishing these at once switches learners to the new version atomically
+        return {
+            'scorm_file': scorm_file_url,
+            'package_version': self.version,
+            'package_storage_mode': self.storage_mode,
+        }
+
+    @staticmethod
+    def _new_version():
+        return '{:%Y%m%d%H%M%S}-{}'.format(datetime.utcnow(), uuid.uuid4().hex[:8])
 
-    def _write_to_file(self, mode):
-        with open(self.temp_file_path, mode) as temp_file:
-            for chunk in self.scorm_file.chunks():
-                temp_file.write(chunk)
+    def _version_location(self, version):
+        if version:
+            return os.path.join(self.block_storage_location, version)
+        return self.block_storage_location
 
     def _extract_and_store(self):
-        cache_key = ScormPackageUploader._get_progress_cache_key(self.xblock.location.block_id)
+        cache_key = ScormPackageUploader._get_progress_cache_key(self.block_id)
         cache.set(cache_key, 0, PROGRESS_CACHE_EXPIRY)
+        ScormPackageUploader.set_upload_phase(self.block_id, PHASE.EXTRACTING)
+
+        package_encoding = self.package_encoding
+        if self.storage_mode == ZIP_STORAGE_MODE:
+            files_to_store, total_files_size = self._zip_package_members(package_encoding)
+            if files_to_store is not None:
+                try:
+                    return self._save_zip_to_storage(files_to_store, total_files_size)
+                finally:
+                    self._post_upload_cleanup(None)
+            logger.warning('SCORM package of {} has members that cannot be served from the zip, '
+                           'storing its files instead'.format(self.block_id))
+            self.storage_mode = FILES_STORAGE_MODE
+
+        if self.stream_extract:
+            unizpped_dir = None
+            files_to_store, total_files_size = self._zip_members_to_store(package_encoding)
+        else:
+            unizpped_dir = self._extract_zipped_file()
+            files_to_store, total_files_size = self._files_to_store(unizpped_dir, package_encoding)
 
-        unizpped_dir = self._extract_zipped_file()
-        storage_url = self._save_to_storage(unizpped_dir)
+        try:
+            storage_url = self._save_to_storage(files_to_store, total_files_size)
+        finally:
+            self._post_upload_cleanup(unizpped_dir)
 
         return storage_url
 
@@ -96,36 +397,418 @@ class ScormPackageUploader:
 
         return tempdir
 
-    def _save_to_storage(self, tempdir):
+    def _save_to_storage(self, files_to_store, total_files_size):
+        ScormPackageUploader.set_upload_phase(self.block_id, PHASE.STORING)
         storage = self._get_storage()
-        self._cleanup_storage_dir(storage)
-
-        files_to_store, total_files_size = self._files_to_store(tempdir)
+        self._collect_retired_versions(storage, stored_version=self.version)
+
+        stored_files = self._load_manifest(storage) if self.deduplicate else None
+        # compressed variants of unchanged files are listed by the index of the previous upload
+        previous_index = None
+        if stored_files is not None:
+            previous_index = load_package_index(
+                storage, self._version_location(self.current_version) if self.versioned else self.scorm_storage_location
+            )
+        # storage is about to change, a failure from here on must not leave a manifest behind
+        self._delete_manifest(storage)
+        if not self.versioned:
+            # nor an index listing files that may be gone
+            delete_package_index(storage, self.scorm_storage_location)
+
+        if stored_files is None:
+            if not self.versioned:
+                self._cleanup_storage_dir(storage)
+            changed_files = files_to_store
+        else:
+            changed_files, removed_paths = self._diff_against_manifest(files_to_store, stored_files)
+            logger.info('SCORM package re-upload: {} of {} files changed, {} removed'.format(
+                len(changed_files), len(files_to_store), len(removed_paths)
+            ))
+            self._keep_variants_of_unchanged(files_to_store, changed_files, previous_index)
+            if self.versioned:
+                # the new version starts empty: unchanged files are copied over from the current one
+                changed_files = self._with_copies_of_unchanged(files_to_store, changed_files)
+            else:
+                self._get_package_storage(storage).bulk_delete(
+                    '{}{}'.format(self.scorm_storage_location, removed_path) for removed_path in removed_paths
+                )
+                self._get_package_storage(storage).bulk_delete(
+                    get_variant_path(self.scorm_storage_location, variant_encoding, removed_path)
+                    for removed_path in removed_paths for variant_encoding in (BROTLI_ENCODING, GZIP_ENCODING)
+                )
+
+        # unchanged files count as already uploaded
+        uploaded_size = total_files_size - sum(file_to_store['size'] for file_to_store in changed_files)
+        self._set_upload_progress(uploaded_size, total_files_size)
+        for stored_size in self._store_files(changed_files):
+            uploaded_size += stored_size
+            self._set_upload_progress(uploaded_size, total_files_size)
+
+        PackageIndex.from_files_to_store(self.scorm_storage_location, files_to_store).save(storage)
+        if self.deduplicate:
+            self._save_manifest(storage, files_to_store)
+        self._retire_replaced_version(storage)
+
+        return self._storage_url(storage)
+
+    def _save_zip_to_storage(self, files_to_store, total_files_size):
+        """
+        Store the uploaded zip as it is, with an index of where its members are
+        """
+        ScormPackageUploader.set_upload_phase(self.block_id, PHASE.STORING)
+        storage = self._get_storage()
+        self._collect_retired_versions(storage, stored_version=self.version)
+        self._delete_manifest(storage)
+        if not self.versioned:
+            delete_package_index(storage, self.scorm_storage_location)
+            self._cleanup_storage_dir(storage)
+
+        self._set_upload_progress(0, total_files_size)
+        zip_path = get_zip_path(self.scorm_storage_location)
+        # stored like a package file named ".zip" appended to the package location, with the same retries
+        self._store_file({
+            'path': self.temp_file_path, 'relative_path': zip_path[len(self.scorm_storage_location):],
+            'size': os.path.getsize(self.temp_file_path)
+        })
+        self._set_upload_progress(total_files_size, total_files_size)
+
+        PackageIndex.from_files_to_store(self.scorm_storage_location, files_to_store, zip_path).save(storage)
+        self._retire_replaced_version(storage)
+
+        return self._storage_url(storage)
+
+    def _storage_url(self, storage):
+        url = storage.url(self.scorm_storage_location)
+        return '?' in url and url[:url.find('?')] or url
 
-        uploaded_size = 0
+    @staticmethod
+    def _keep_variants_of_unchanged(files_to_store, changed_files, previous_index):
+        if previous_index is None:
+            return
+        changed_paths = set(file_to_store['relative_path'] for file_to_store in changed_files)
         for file_to_store in files_to_store:
-            # defensive decode/encode from zip
-            file_temp_path = file_to_store['path']
-            file_relative_path = file_temp_path.decode(self.xblock.encoding).encode('utf-8').replace(tempdir, '')
-
-            with open(file_temp_path, FileAccessMode.READ_WRITE) as fh:
-                try:
+            if file_to_store['relative_path'] not in changed_paths:
+                entry = previous_index.get(file_to_store['relative_path'])
+                file_to_store['encodings'] = entry['encodings'] if entry else {}
+
+    def _with_copies_of_unchanged(self, files_to_store, changed_files):
+        changed_paths = set(file_to_store['relative_path'] for file_to_store in changed_files)
+        current_location = self._version_location(self.current_version)
+        files = list(changed_files)
+        for file_to_store in files_to_store:
+            if file_to_store['relative_path'] not in changed_paths:
+                copy = dict(file_to_store, copy_from='{}{}'.format(current_location, file_to_store['relative_path']))
+                files.append(copy)
+        return files
+
+    def _store_files(self, files_to_store):
+        """
+        Store files using a pool of `upload_workers` threads, yielding
+        the stored size of every file as soon as it is done
+        """
+        workers = min(self.upload_workers, len(files_to_store))
+        if workers <= 1:
+            for file_to_store in files_to_store:
+                yield self._store_file(file_to_store)
+            return
+
+        pool = ThreadPool(workers)
+        try:
+            for stored_size in pool.imap_unordered(self._store_file, files_to_store):
+                yield stored_size
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _store_file(self, file_to_store):
+        """
+        Store a single file, retrying failed saves with exponential backoff.
+        Returns the number of bytes stored.
+        """
+        file_relative_path = file_to_store['relative_path']
+        storage_path = '{}{}'.format(self.scorm_storage_location, file_relative_path)
+        storage = self._get_thread_storage()
+
+        attempt = 0
+        while True:
+            try:
+                if file_to_store.get('replace'):
+                    storage.delete(storage_path)
+                    for variant_encoding in (BROTLI_ENCODING, GZIP_ENCODING):
+                        storage.delete(
+                            get_variant_path(self.scorm_storage_location, variant_encoding, file_relative_path)
+                        )
+                if 'copy_from' in file_to_store:
+                    self._copy_stored_file(storage, file_to_store['copy_from'], storage_path)
+                    self._copy_variants(storage, file_to_store)
+                    return file_to_store['size']
+                with self._open_file_to_store(file_to_store) as fh:
                     logger.info(
                         'Storing file `{}` of size `{}` on S3'.format(file_relative_path, file_to_store['size'])
                     )
-                    storage.save('{}{}'.format(self.scorm_storage_location, file_relative_path), fh)
+                    storage.save(storage_path, fh)
                     logger.info('File `{}` stored.'.format(file_relative_path))
-                    uploaded_size += file_to_store['size']
-                    self._set_upload_progress(uploaded_size, total_files_size)
-                except encoding.DjangoUnicodeDecodeError as e:
-                    logger.warn('SCORM XBlock Couldn\'t store file {} to storage. {}'.format(file_to_store, e))
+                self._store_variants(storage, file_to_store)
+                return file_to_store['size']
+            except encoding.DjangoUnicodeDecodeError as e:
+                logger.warn('SCORM XBlock Couldn\'t store file {} to storage. {}'.format(file_to_store, e))
+                return 0
+            except Exception as e:
+                if attempt >= self.upload_max_retries:
+                    raise
+                delay = self.upload_retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning('Storing file `{}` failed ({}), retry {} of {} in {}s'.format(
+                    file_relative_path, e, attempt, self.upload_max_retries, delay
+                ))
+                self._discard_partial_file(storage, storage_path)
+                time.sleep(delay)
+
+    def _store_variants(self, storage, file_to_store):
+        """
+        Store compressed variants of a text file, recording their sizes in `encodings`.
+        A variant that can't be stored is skipped, the file is then served uncompressed.
+        """
+        file_to_store['encodings'] = {}
+        relative_path = file_to_store['relative_path']
+        content_type = guess_content_type(self._manifest_key(relative_path))
+        if not self.precompress or not is_compressible(
+                content_type, file_to_store['size'], self.precompress_min_size, self.precompress_types):
+            return
+
+        try:
+            with self._open_file_to_store(file_to_store) as fh:
+                variants = compress_variants(fh.read())
+            for variant_encoding, compressed in variants.items():
+                storage.save(
+                    get_variant_path(self.scorm_storage_location, variant_encoding, relative_path),
+                    ContentFile(compressed)
+                )
+                file_to_store['encodings'][variant_encoding] = len(compressed)
+        except Exception as e:
+            logger.warning('Compressed variants of `{}` not stored: {}'.format(relative_path, e))
+
+    def _copy_variants(self, storage, file_to_store):
+        current_location = self._version_location(self.current_version)
+        for variant_encoding in file_to_store.get('encodings', {}):
+            self._copy_stored_file(
+                storage,
+                get_variant_path(current_location, variant_encoding, file_to_store['relative_path']),
+                get_variant_path(self.scorm_storage_location, variant_encoding, file_to_store['relative_path'])
+            )
+
+    @contextmanager
+    def _open_file_to_store(self, file_to_store):
+        """
+        Open a file to store, either extracted on disk or a member of the uploaded zip
+        """
+        if 'member' not in file_to_store:
+            with open(file_to_store['path'], FileAccessMode.READ_WRITE) as fh:
+                yield fh
+            return
+
+        member = self._get_thread_zip_file().open(file_to_store['member'])
+        try:
+            if not getattr(member, 'seekable', lambda: False)():
+                # storage backends rewind their content (e.g. boto to compute the MD5),
+                # which older zipfile members can't do: spool those to memory, or disk if large
+                spooled = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MAX_SIZE)
+                shutil.copyfileobj(member, spooled)
+                spooled.seek(0)
+                member.close()
+                member = spooled
+            content = File(member, name=file_to_store['relative_path'])
+            content.size = file_to_store['size']
+            yield content
+        finally:
+            member.close()
+
+    def _load_manifest(self, storage):
+        """
+        Files stored for this block by the previous upload, as a dict of
+        relative path to content hash. None if unknown.
+        """
+        try:
+            if not storage.exists(self.manifest_path):
+                return None
+            with storage.open(self.manifest_path, 'rb') as manifest_file:
+                manifest = json.loads(manifest_file.read().decode('utf-8'))
+        except (ValueError, IOError) as e:
+            logger.warning('SCORM package manifest {} is unreadable: {}'.format(self.manifest_path, e))
+            return None
+
+        if manifest.get('version', '') != (self.current_version if self.versioned else ''):
+            # describes files stored elsewhere than where this upload compares against
+            return None
+        return manifest.get('files')
+
+    def _save_manifest(self, storage, files_to_store):
+        manifest = {
+            'version': self.version,
+            'files': {
+                self._manifest_key(file_to_store['relative_path']): file_to_store['hash']
+                for file_to_store in files_to_store
+            }
+        }
+        storage.save(self.manifest_path, ContentFile(json.dumps(manifest).encode('utf-8')))
+
+    def _delete_manifest(self, storage):
+        try:
+            storage.delete(self.manifest_path)
+        except Exception:
+            pass
 
-        self._post_upload_cleanup(tempdir)
+    def _diff_against_manifest(self, files_to_store, stored_files):
+        """
+        Returns the files to store that were added or changed since the manifest
+        was written, and the relative paths of the stored files that were removed
+        """
+        changed_files = []
+        package_paths = set()
+        for file_to_store in files_to_store:
+            key = self._manifest_key(file_to_store['relative_path'])
+            package_paths.add(key)
+            stored_hash = stored_files.get(key)
+            if stored_hash != file_to_store['hash']:
+                # changed files must replace the stored ones instead of being saved under a new name
+                file_to_store['replace'] = stored_hash is not None
+                changed_files.append(file_to_store)
 
-        url = storage.url(self.scorm_storage_location)
-        return '?' in url and url[:url.find('?')] or url
+        removed_paths = [path for path in stored_files if path not in package_paths]
+        return changed_files, removed_paths
+
+    @staticmethod
+    def _manifest_key(relative_path):
+        if isinstance(relative_path, six.binary_type):
+            return relative_path.decode('utf-8')
+        return relative_path
+
+    @staticmethod
+    def _content_hash(crc, size):
+        """
+        Content hash of a package file, from its CRC32 as listed in the zip
+        """
+        return '{:08x}-{}'.format(crc & 0xffffffff, size)
+
+    @staticmethod
+    def _file_crc32(file_path):
+        crc = 0
+        with open(file_path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+        return crc
+
+    def _copy_stored_file(self, storage, source_path, storage_path):
+        """
+        Copy a file within storage, server side when stored on S3
+        """
+        self._get_package_storage(storage).copy(source_path, storage_path)
+
+    def _get_package_storage(self, storage):
+        return get_package_storage(storage, delete_workers=self.upload_workers)
+
+    def _load_versions(self, storage):
+        """
+        Package versions replaced by later uploads, waiting to be deleted
+        """
+        try:
+            if storage.exists(self.versions_path):
+                with storage.open(self.versions_path, 'rb') as versions_file:
+                    return json.loads(versions_file.read().decode('utf-8')).get('retired', [])
+        except (ValueError, IOError) as e:
+            logger.warning('SCORM package versions {} are unreadable: {}'.format(self.versions_path, e))
+        return []
+
+    def _save_versions(self, storage, retired):
+        storage.delete(self.versions_path)
+        storage.save(self.versions_path, ContentFile(json.dumps({'retired': retired}).encode('utf-8')))
+
+    def _retire_version(self, storage, version):
+        retired = [entry for entry in self._load_versions(storage) if entry['version'] != version]
+        retired.append({'version': version, 'retired_at': time.time()})
+        self._save_versions(storage, retired)
+
+    def _retire_replaced_version(self, storage):
+        """
+        Retire the version replaced by this upload, also when versioning was
+        turned on or off in between
+        """
+        if self.current_version is not None and self.current_version != self.version:
+            self._retire_version(storage, self.current_version)
+
+    def _collect_retired_versions(self, storage, stored_version=None):
+        """
+        Delete the versions retired longer than the grace period ago, but
+        `stored_version`, the one being uploaded. Returns the deleted versions.
+        """
+        retired = self._load_versions(storage)
+        now = time.time()
+        kept, deleted = [], []
+        for entry in retired:
+            if entry['version'] == stored_version:
+                # an unversioned upload stores the package where the retired pre-versioning one was
+                continue
+            expired = now - entry['retired_at'] > self.version_grace_period
+            if expired and entry['version'] != self.current_version:
+                logger.info('Deleting SCORM package version `{}` of {}'.format(entry['version'], self.block_id))
+                self._delete_version(storage, entry['version'])
+                deleted.append(entry['version'])
+            else:
+                kept.append(entry)
+        if len(kept) != len(retired):
+            self._save_versions(storage, kept)
+        return deleted
+
+    def delete_retired_versions(self):
+        """
+        Delete the versions retired longer than the grace period ago, without an upload
+        """
+        return self._collect_retired_versions(self._get_storage())
+
+    def _delete_version(self, storage, version):
+        delete_package_index(storage, self._version_location(version))
+        storage.delete(get_zip_path(self._version_location(version)))
+        self._delete_storage_dir(storage, get_variants_location(self._version_location(version)))
+        if version:
+            self._delete_storage_dir(storage, self._version_location(version))
+            return
+
+        # files of the package uploaded before versioning sit next to the version directories and their indexes
+        package_storage = self._get_package_storage(storage)
+        package_storage.bulk_delete(
+            path for path in package_storage.list_files(self.block_storage_location)
+            if not VERSION_RE.match(os.path.relpath(path, self.block_storage_location).split('/')[0].split('.')[0])
+        )
+
+    def _discard_partial_file(self, storage, storage_path):
+        """
+        Remove whatever a failed save left behind, so the retry doesn't get a renamed copy
+        """
+        try:
+            if storage.exists(storage_path):
+                storage.delete(storage_path)
+        except Exception:
+            pass
+
+    def _get_thread_storage(self):
+        storage = getattr(self._thread_local, 'storage', None)
+        if storage is None:
+            storage = self._thread_local.storage = self._get_storage()
+        return storage
+
+    def _get_thread_zip_file(self):
+        """
+        Zip members are read concurrently, so every worker reads through its own handle
+        """
+        zip_file = getattr(self._thread_local, 'zip_file', None)
+        if zip_file is None:
+            zip_file = self._thread_local.zip_file = zipfile.ZipFile(self.temp_file_path, 'r')
+            with self._zip_files_lock:
+                self._zip_files.append(zip_file)
+        return zip_file
 
-    def _get_storage(self):
+    @staticmethod
+    def _get_storage():
         if settings.DEFAULT_FILE_STORAGE == 'storages.backends.s3boto.S3BotoStorage':
             s3_boto_storage_class = get_storage_class()
             # initializing S3 storage with private acl
@@ -137,17 +820,15 @@ class ScormPackageUploader:
 
     def _cleanup_storage_dir(self, storage):
         if storage.exists(os.path.join(self.scorm_storage_location, 'imsmanifest.xml')):
-            try:
-                shutil.rmtree(os.path.join(storage.location, self.scorm_storage_location))
-            except OSError:
-                # TODO: for now we are going to assume this means it's stored on S3 if not local
-                try:
-                    for key in storage.bucket.list(prefix=self.scorm_storage_location):
-                        key.delete()
-                except AttributeError:  # pylint: disable=try-except-raise
-                    raise
+            self._delete_storage_dir(storage, self.scorm_storage_location)
+        self._delete_storage_dir(storage, get_variants_location(self.scorm_storage_location))
+        storage.delete(get_zip_path(self.scorm_storage_location))
 
-    def _files_to_store(self, tempdir):
+    def _delete_storage_dir(self, storage, location):
+        deleted = self._get_package_storage(storage).delete_dir(location)
+        logger.info('Deleted {} files under {}'.format(deleted, location))
+
+    def _files_to_store(self, tempdir, package_encoding):
         files_to_store = []
         total_files_size = 0
 
@@ -156,34 +837,93 @@ class ScormPackageUploader:
                 file_path = os.path.join(os.path.abspath(dirpath), f)
                 size = os.path.getsize(file_path)
                 total_files_size += size
-                files_to_store.append({'path': file_path, 'size': size})
+                # defensive decode/encode from zip
+                relative_path = file_path.decode(package_encoding).encode('utf-8').replace(tempdir, '')
+                file_hash = self._content_hash(self._file_crc32(file_path), size)
+                files_to_store.append({
+                    'path': file_path, 'relative_path': relative_path, 'size': size, 'hash': file_hash
+                })
 
         return files_to_store, total_files_size
 
-    def _set_upload_progress(self, uploaded, total):
-        percent = int(uploaded / float(total) * 100)
-        block_id = self.xblock.location.block_id
+    def _zip_members_to_store(self, package_encoding):
+        """
+        List the files to store straight from the zip's central directory
+        """
+        files_to_store = []
+        total_files_size = 0
 
-        cache_key = ScormPackageUploader._get_progress_cache_key(block_id)
+        with zipfile.ZipFile(self.temp_file_path, 'r') as zip_file:
+            for info in zip_file.infolist():
+                relative_path = self._member_relative_path(info, package_encoding)
+                if not relative_path:
+                    continue
+                total_files_size += info.file_size
+                files_to_store.append({
+                    'member': info, 'relative_path': relative_path, 'size': info.file_size,
+                    'hash': self._content_hash(info.CRC, info.file_size)
+                })
+
+        return files_to_store, total_files_size
+
+    def _zip_package_members(self, package_encoding):
+        """
+        Files of the package with where their data is in the zip,
+        None if some can't be served from the zip
+        """
+        files_to_store = []
+        total_files_size = 0
+
+        with zipfile.ZipFile(self.temp_file_path, 'r') as zip_file:
+            for info in zip_file.infolist():
+                relative_path = self._member_relative_path(info, package_encoding)
+                if not relative_path:
+                    continue
+                if not is_servable(info):
+                    return None, 0
+                total_files_size += info.file_size
+                files_to_store.append({
+                    'relative_path': relative_path, 'size': info.file_size,
+                    'hash': self._content_hash(info.CRC, info.file_size),
+                    'zip': [member_data_offset(zip_file, info), info.compress_size, info.compress_type, info.CRC],
+                })
+
+        return files_to_store, total_files_size
+
+    @staticmethod
+    def _member_relative_path(info, package_encoding):
+        """
+        Storage path of a zip member relative to the package directory, sanitized
+        the way `ZipFile.extractall` does. Returns None for directory entries.
+        """
+        name = info.filename
+        if isinstance(name, six.binary_type):
+            name = name.decode(package_encoding)
+        elif not info.flag_bits & ZIP_UTF8_FLAG:
+            # zipfile decoded the name as cp437, decode it with the package encoding instead
+            try:
+                name = name.encode('cp437').decode(package_encoding)
+            except (UnicodeEncodeError, UnicodeDecodeError):
+                pass
+
+        parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+        if not parts or name.endswith('/'):
+            return None
+
+        return '/' + '/'.join(parts)
+
+    def _set_upload_progress(self, uploaded, total):
+        percent = int(uploaded / float(total) * 100) if total else 100
+        cache_key = ScormPackageUploader._get_progress_cache_key(self.block_id)
         cache.set(cache_key, percent, PROGRESS_CACHE_EXPIRY)
 
     def _post_upload_cleanup(self, tempdir):
+        for zip_file in self._zip_files:
+            zip_file.close()
         try:
-            shutil.rmtree(tempdir)
+            if tempdir:
+                shutil.rmtree(tempdir)
             os.remove(self.temp_file_path)
         except Exception:
             pass
-
-    @staticmethod
-    def _get_progress_cache_key(block_id):
-        return 'upload_percent_{}'.format(block_id)
-
-    @staticmethod
-    def get_upload_percentage(block_id):
-        cache_key = ScormPackageUploader._get_progress_cache_key(block_id)
-        return cache.get(cache_key, 100)
-
-    @staticmethod
-    def clear_percentage_cache(block_id):
-        cache_key = ScormPackageUploader._get_progress_cache_key(block_id)
-        cache.delete(cache_key)
+        self.chunk_store.cleanup()
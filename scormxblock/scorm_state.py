@@ -0,0 +1,105 @@
+"""
+Parsed SCORM runtime state of a learner
+
+`raw_scorm_status` holds the whole state sent by the player as JSON, including
+every interaction, and easily reaches hundreds of KB. A handler parses it once
+into a ScormState, changes it in place and serializes it once at the end.
+
+The stored field can hold the JSON compressed, see `encode_raw_status`.
+"""
+from __future__ import absolute_import
+
+import base64
+import json
+import zlib
+
+import six
+
+# stored value of a compressed status: this prefix, then the base64 of the zlib compressed JSON
+ZLIB_STATUS_PREFIX = 'z1:'
+
+
+class ScormState(object):
+    """
+    State as stored by the player: a dict with the lesson `status`, `score`
+    and the CMI `data` of every SCO under `scos`
+    """
+    def __init__(self, data=None):
+        self.data = data if data is not None else {}
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(json.loads(raw or '{}'))
+
+    @classmethod
+    def wrap(cls, state):
+        """
+        ScormState of `state`, which can be parsed state or a ScormState already
+        """
+        return state if isinstance(state, cls) else cls(state)
+
+    def to_json(self):
+        return json.dumps(self.data)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    __nonzero__ = __bool__  # python 2
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    @property
+    def scos(self):
+        return self.data.get('scos') or {}
+
+    def set_sco_values(self, key, val, overwrite=False):
+        """
+        Set a value for a key on all SCOs
+        """
+        scos = self.data.get('scos')
+        if not scos:
+            return
+        for sco in scos.values():
+            if not sco.get('key') or (sco.get('key') and overwrite):
+                sco[key] = val
+
+    def patched(self, patch):
+        """
+        New ScormState with a JSON merge patch (RFC 7386) applied: objects are
+        merged key by key, null deletes a key, any other value replaces it.
+        Only the objects along the patched keys are copied, this state is left as is.
+        """
+        return ScormState(_merge_patch(self.data, patch))
+
+
+def _merge_patch(target, patch):
+    if not isinstance(patch, dict):
+        return patch
+    merged = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = _merge_patch(merged.get(key), value)
+    return merged
+
+
+def encode_raw_status(raw_status):
+    """
+    Value to store for the JSON status `raw_status`: compressed, unless that
+    doesn't make it any smaller
+    """
+    data = raw_status.encode('utf-8') if isinstance(raw_status, six.text_type) else raw_status
+    encoded = ZLIB_STATUS_PREFIX + base64.b64encode(zlib.compress(data)).decode('ascii')
+    return encoded if len(encoded) < len(raw_status) else raw_status
+
+
+def decode_raw_status(stored_status):
+    """
+    JSON status of a stored value, either compressed or plain JSON
+    """
+    if stored_status and stored_status.startswith(ZLIB_STATUS_PREFIX):
+        data = base64.b64decode(stored_status[len(ZLIB_STATUS_PREFIX):])
+        return zlib.decompress(data).decode('utf-8')
+    return stored_status
@@ -0,0 +1,88 @@
+"""
+Per-SCO summary of a learner's SCORM state
+
+The progress, score and status of every SCO are kept in a small dict
+next to `raw_scorm_status`. A commit only summarizes the SCOs it changed, and
+grade and progress are rolled up from the summary, without walking the stored
+state again.
+"""
+from __future__ import absolute_import
+
+PROGRESS_ELEMENT = 'cmi.progress_measure'
+SCORE_ELEMENTS = ('cmi.core.score.raw', 'cmi.score.raw')
+SCALED_SCORE_ELEMENT = 'cmi.score.scaled'
+STATUS_ELEMENTS = ('cmi.success_status', 'cmi.completion_status', 'cmi.core.lesson_status')
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sco_summary(sco):
+    """
+    Summary of a SCO of the state: its progress measure, raw score (None if
+    it has none) and status
+    """
+    sco_data = sco.get('data')
+    if not isinstance(sco_data, dict):
+        sco_data = {}
+
+    score = None
+    for name in SCORE_ELEMENTS:
+        score = _float(sco_data.get(name))
+        if score is not None:
+            break
+    if score is None and _float(sco_data.get(SCALED_SCORE_ELEMENT)) is not None:
+        score = max(_float(sco_data[SCALED_SCORE_ELEMENT]), 0) * 100
+
+    status = ''
+    for name in STATUS_ELEMENTS:
+        value = sco_data.get(name) or sco.get(name)
+        if value and value != 'unknown':
+            status = value
+            break
+
+    return {
+        'progress': _float(sco_data.get(PROGRESS_ELEMENT)) or 0.0,
+        'score': score,
+        'status': status,
+    }
+
+
+def summarize_scos(scos):
+    return dict((sco_id, sco_summary(sco)) for sco_id, sco in scos.items() if isinstance(sco, dict))
+
+
+def updated_summary(summary, scos, sco_ids):
+    """
+    Copy of `summary` with the SCOs `sco_ids` summarized again from `scos`
+    """
+    summary = dict(summary)
+    for sco_id in sco_ids:
+        sco = scos.get(sco_id)
+        if isinstance(sco, dict):
+            summary[sco_id] = sco_summary(sco)
+        else:
+            summary.pop(sco_id, None)
+    return summary
+
+
+def rollup_progress(summary):
+    """
+    Average progress measure of the SCOs, 0 if there are none
+    """
+    if not summary:
+        return 0
+    return sum(sco['progress'] for sco in summary.values()) / len(summary)
+
+
+def rollup_score(summary):
+    """
+    Average of the SCOs' scores, SCOs without a score counting as 0, None if no SCO has a score
+    """
+    if all(sco['score'] is None for sco in summary.values()):
+        return None
+    return sum(sco['score'] or 0 for sco in summary.values()) / len(summary)
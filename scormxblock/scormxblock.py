@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 
 import encodings
+import fnmatch
+import functools
 import json
 import logging
-import mimetypes
 import os
+import zipfile
 from datetime import datetime
 
 import pkg_resources
@@ -14,18 +16,34 @@ from django.conf import settings
 from django.core.files.storage import default_storage
 from django.http import QueryDict
 from mako.template import Template as MakoTemplate
-from six.moves import range
 from webob import Response
 from xblock.core import XBlock
-from xblock.fields import Boolean, DateTime, Float, Integer, Scope, String
+from xblock.exceptions import JsonHandlerError
+from xblock.fields import Boolean, DateTime, Dict, Float, Integer, Scope, String
 from xblock.fragment import Fragment
 
 from openedx.core.lib.xblock_utils import add_staff_markup
 from util.date_utils import get_default_time_display
 
 from . import constants
+from .cmi_model import CHILDREN, DEFAULT_SCO_ID, ELEMENTS, SCORM_12, CmiDataModel
+from .content_cache import get_content_cache
+from .disk_cache import LocalFileIter, copy_stored_file, get_disk_cache
+from .package_index import get_package_index, guess_content_type
+from .package_storage import get_package_storage
+from .precompress import DEFAULT_PRECOMPRESS_MIN_SIZE, GZIP_ENCODING, choose_encoding
+from .proxy_response import cached_content_response, content_response, stored_file_response
+from .publish_policy import PUBLISH_CHANGED, publish_counters, should_publish
+from .report_data import iter_user_interactions, user_interactions
+from .scorm_file_uploader import PHASE as UPLOAD_PHASE
 from .scorm_file_uploader import STATE as UPLOAD_STATE
-from .scorm_file_uploader import ScormPackageUploader
+from .scorm_file_uploader import ChunkIntegrityError, ScormPackageUploader
+from .scorm_state import ScormState, decode_raw_status, encode_raw_status
+from .scorm_summary import rollup_progress, rollup_score, summarize_scos, updated_summary
+from .signed_urls import signed_url
+from .status_coalescing import get_status_coalescer, store_now_key
+from .upload_jobs import get_job_backend
+from .zip_package import FILES_STORAGE_MODE, ZIP_STORAGE_MODE, ZipMemberIter, local_range_reader
 
 
 # Make '_' a no-op so we can scrape strings
@@ -33,6 +51,13 @@ def _(text):
     return text
 
 
+def _js_json(value):
+    """
+    JSON of `value` safe to render in an inline script
+    """
+    return json.dumps(value).replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
 logger = logging.getLogger(__name__)
 
 # importing directly from settings.XBLOCK_SETTINGS doesn't work here... doesn't have vals from ENV TOKENS yet
@@ -40,10 +65,46 @@ scorm_settings = settings.ENV_TOKENS['XBLOCK_SETTINGS']['ScormXBlock'] if hasatt
 DEFINED_PLAYERS = scorm_settings.get("SCORM_PLAYER_BACKENDS", {})
 SCORM_STORAGE = scorm_settings.get("SCORM_PKG_STORAGE_DIR", "scorms")
 SCORM_DISPLAY_STAFF_DEBUG_INFO = scorm_settings.get("SCORM_DISPLAY_STAFF_DEBUG_INFO", False)
+SCORM_PKG_UPLOAD_WORKERS = scorm_settings.get("SCORM_PKG_UPLOAD_WORKERS", 1)
+SCORM_PKG_UPLOAD_MAX_RETRIES = scorm_settings.get("SCORM_PKG_UPLOAD_MAX_RETRIES", 3)
+SCORM_PKG_UPLOAD_RETRY_BACKOFF = scorm_settings.get("SCORM_PKG_UPLOAD_RETRY_BACKOFF", 1)
+SCORM_PKG_STREAM_EXTRACT = scorm_settings.get("SCORM_PKG_STREAM_EXTRACT", False)
+SCORM_PKG_DEDUPLICATE = scorm_settings.get("SCORM_PKG_DEDUPLICATE", False)
+SCORM_PKG_CHUNK_STORE = scorm_settings.get("SCORM_PKG_CHUNK_STORE", "local")
+SCORM_PKG_CHUNK_STORAGE_DIR = scorm_settings.get("SCORM_PKG_CHUNK_STORAGE_DIR", "scorm_uploads")
+SCORM_PKG_VERSIONED = scorm_settings.get("SCORM_PKG_VERSIONED", True)
+SCORM_PKG_VERSION_GRACE_PERIOD = scorm_settings.get("SCORM_PKG_VERSION_GRACE_PERIOD", 24 * 60 * 60)
+SCORM_PKG_JOB_BACKEND = scorm_settings.get("SCORM_PKG_JOB_BACKEND", "thread")
+SCORM_PKG_JOB_WORKERS = scorm_settings.get("SCORM_PKG_JOB_WORKERS", 2)
+SCORM_PKG_JOB_QUEUE = scorm_settings.get("SCORM_PKG_JOB_QUEUE", None)
+SCORM_PKG_PRECOMPRESS = scorm_settings.get("SCORM_PKG_PRECOMPRESS", False)
+SCORM_PKG_PRECOMPRESS_MIN_SIZE = scorm_settings.get("SCORM_PKG_PRECOMPRESS_MIN_SIZE", DEFAULT_PRECOMPRESS_MIN_SIZE)
+SCORM_PKG_PRECOMPRESS_TYPES = scorm_settings.get("SCORM_PKG_PRECOMPRESS_TYPES", None)
+SCORM_PKG_STORAGE_MODE = scorm_settings.get("SCORM_PKG_STORAGE_MODE", FILES_STORAGE_MODE)
+SCORM_PROXY_CACHE_MAX_AGE = scorm_settings.get("SCORM_PROXY_CACHE_MAX_AGE", 60 * 60)
+SCORM_PROXY_MEMORY_CACHE_SIZE = scorm_settings.get("SCORM_PROXY_MEMORY_CACHE_SIZE", 0)
+SCORM_PROXY_MEMORY_CACHE_MAX_OBJECT_SIZE = scorm_settings.get("SCORM_PROXY_MEMORY_CACHE_MAX_OBJECT_SIZE", 1024 * 1024)
+SCORM_PROXY_SHARED_CACHE = scorm_settings.get("SCORM_PROXY_SHARED_CACHE", None)
+SCORM_PROXY_DISK_CACHE_DIR = scorm_settings.get("SCORM_PROXY_DISK_CACHE_DIR", None)
+SCORM_PROXY_DISK_CACHE_SIZE = scorm_settings.get("SCORM_PROXY_DISK_CACHE_SIZE", 1024 * 1024 * 1024)
+SCORM_PROXY_REDIRECT = scorm_settings.get("SCORM_PROXY_REDIRECT", True)
+SCORM_PROXY_REDIRECT_MIN_SIZE = scorm_settings.get("SCORM_PROXY_REDIRECT_MIN_SIZE", 1024 * 1024)
+SCORM_PROXY_REDIRECT_EXCLUDE = scorm_settings.get(
+    "SCORM_PROXY_REDIRECT_EXCLUDE", ["*.html", "*.htm", "imsmanifest.xml"]
+)
+SCORM_PROXY_REDIRECT_EXPIRY = scorm_settings.get("SCORM_PROXY_REDIRECT_EXPIRY", 5 * 60)
+SCORM_PROXY_REDIRECT_BASE_URL = scorm_settings.get("SCORM_PROXY_REDIRECT_BASE_URL", None)
+SCORM_PROXY_REDIRECT_SIGNING_KEY = scorm_settings.get("SCORM_PROXY_REDIRECT_SIGNING_KEY", None)
+SCORM_PUBLISH_POLICY = scorm_settings.get("SCORM_PUBLISH_POLICY", PUBLISH_CHANGED)
+SCORM_REPORT_WORKERS = scorm_settings.get("SCORM_REPORT_WORKERS", 0)
+SCORM_STATUS_COALESCE_WINDOW = scorm_settings.get("SCORM_STATUS_COALESCE_WINDOW", 0)
+SCORM_STATUS_COALESCE_CACHE = scorm_settings.get("SCORM_STATUS_COALESCE_CACHE", "default")
+SCORM_STATUS_COMPRESS = scorm_settings.get("SCORM_STATUS_COMPRESS", True)
 SCORM_PKG_INTERNAL = {"value": "SCORM_PKG_INTERNAL", "display_name": "Internal Player: index.html in SCORM package"}
 DEFAULT_SCO_MAX_SCORE = 100
 DEFAULT_IFRAME_WIDTH = 800
 DEFAULT_IFRAME_HEIGHT = 400
+SCORM_STATUS_REVISION_HEADER = "X-Scorm-Status-Revision"
 
 AVAIL_ENCODINGS = encodings.aliases.aliases
 
@@ -78,11 +139,22 @@ class ScormXBlock(XBlock):
         help=_("SCORM player configured in Django settings, or index.html file contained in SCORM package"),
         scope=Scope.settings
     )
-    # this stores latest raw SCORM API data in JSON string
+    # this stores latest raw SCORM API data in JSON string, possibly compressed:
+    # read and write it with _load_raw_scorm_status and _store_raw_scorm_status
     raw_scorm_status = String(
         scope=Scope.user_state,
         default='{}'
     )
+    # bumped on every change of raw_scorm_status, patches must be based on the latest one
+    raw_scorm_status_revision = Integer(
+        scope=Scope.user_state,
+        default=0
+    )
+    # client, sequence number and base revision of the first of the last patches sent by one page
+    raw_scorm_status_patch = Dict(
+        scope=Scope.user_state,
+        default={}
+    )
     scorm_initialized = Boolean(
         scope=Scope.user_state,
         default=False
@@ -95,10 +167,28 @@ class ScormXBlock(XBlock):
         scope=Scope.user_state,
         default=0
     )
+    # progress, score and status of every SCO, see scorm_summary
+    scorm_summary = Dict(
+        scope=Scope.user_state,
+        default={}
+    )
     scorm_progress = Float(
         scope=Scope.user_state,
         default=0
     )
+    # last grade and completion published to the LMS, None until published once
+    last_published_grade = Float(
+        scope=Scope.user_state,
+        default=None
+    )
+    last_published_max_grade = Float(
+        scope=Scope.user_state,
+        default=None
+    )
+    last_published_completion = Float(
+        scope=Scope.user_state,
+        default=None
+    )
     weight = Integer(
         default=1,
         help=_('SCORM block\'s problem weight in the course, in points.  If not graded, set to 0'),
@@ -176,6 +266,14 @@ class ScormXBlock(XBlock):
         default=None, scope=Scope.settings,
         help="Scorm File Last Uploaded Date"
     )
+    package_version = String(
+        default="", scope=Scope.settings,
+        help="Version of the uploaded SCORM package in storage, empty for packages uploaded before versioning"
+    )
+    package_storage_mode = String(
+        default=FILES_STORAGE_MODE, scope=Scope.settings,
+        help="How the uploaded SCORM package is stored: as extracted files, or as the uploaded zip"
+    )
 
     @property
     def student_id(self):
@@ -219,6 +317,9 @@ class ScormXBlock(XBlock):
         return data.decode("utf8")
 
     def student_view(self, context=None, authoring=False):
+        if not authoring:
+            # a commit kept by the coalescing window when the learner last left
+            self._store_pending_scorm_status()
         scheme = 'https' if settings.HTTPS == 'on' else 'http'
         lms_base = settings.ENV_TOKENS.get('LMS_BASE')
         if isinstance(context, QueryDict):
@@ -227,7 +328,12 @@ class ScormXBlock(XBlock):
         scorm_player_url = ""
 
         course_directory = self.scorm_file
-        if self.scorm_player == 'SCORM_PKG_INTERNAL':
+        if self.scorm_player == 'SCORM_PKG_INTERNAL' and self.package_storage_mode == ZIP_STORAGE_MODE:
+            # files of a zip stored package can only be served by proxy_content
+            scorm_player_url = '{}://{}{}/index.html'.format(
+                scheme, lms_base, self.runtime.handler_url(self, "proxy_content").rstrip('/')
+            )
+        elif self.scorm_player == 'SCORM_PKG_INTERNAL':
             # TODO: support initial filename other than index.html for internal players
             scorm_player_url = '{}://{}{}'.format(scheme, lms_base, self.scorm_file)
         elif self.scorm_player:
@@ -246,12 +352,17 @@ class ScormXBlock(XBlock):
         if not authoring:
             get_url = '{}://{}{}'.format(scheme, lms_base, self.runtime.handler_url(self, "get_raw_scorm_status"))
             set_url = '{}://{}{}'.format(scheme, lms_base, self.runtime.handler_url(self, "set_raw_scorm_status"))
+            patch_url = '{}://{}{}'.format(scheme, lms_base, self.runtime.handler_url(self, "patch_raw_scorm_status"))
+            flush_url = '{}://{}{}'.format(scheme, lms_base, self.runtime.handler_url(self, "flush_raw_scorm_status"))
+            # for the player's final commit (finish, exit, unload), stored right away
+            final_set_url = '{}://{}{}'.format(scheme, lms_base, self.runtime.handler_url(
+                self, "set_raw_scorm_status", query='flush=1'))
             get_completion_url = '{}://{}{}'.format(scheme, lms_base,
                                                     self.runtime.handler_url(self, "get_scorm_completion"))
         # PreviewModuleSystem (runtime Mixin from Studio) won't have a hostname
         else:
             # we don't want to get/set SCORM status from preview
-            get_url = set_url = get_completion_url = '#'
+            get_url = set_url = final_set_url = patch_url = flush_url = get_completion_url = '#'
 
         # if display type is popup, don't use the full window width for the host iframe
         iframe_width = self.display_type == 'popup' and DEFAULT_IFRAME_WIDTH or self.display_width
@@ -265,7 +376,8 @@ class ScormXBlock(XBlock):
 
         frag = Fragment()
         frag.add_content(MakoTemplate(text=html.format(self=self, scorm_player_url=scorm_player_url,
-                                                       get_url=get_url, set_url=set_url,
+                                                       get_url=get_url, set_url=set_url, patch_url=patch_url,
+                                                       final_set_url=final_set_url, flush_url=flush_url,
                                                        get_completion_url=get_completion_url,
                                                        iframe_width=iframe_width, iframe_height=iframe_height,
                                                        player_config=player_config,
@@ -276,6 +388,12 @@ class ScormXBlock(XBlock):
 
         frag.add_css(self.resource_string("static/css/scormxblock.css"))
         context['block_id'] = self.url_name
+        # the SCORM 1.2 data model of the page's API and the learner's values it starts from
+        context['cmi_elements'] = _js_json([[regex.pattern, access] for regex, access, _ in ELEMENTS[SCORM_12]])
+        context['cmi_children'] = _js_json(CHILDREN[SCORM_12])
+        cmi_values = self._cmi_fallback_values()
+        cmi_values.update(self._cmi_runtime_values())
+        context['cmi_values'] = _js_json(cmi_values)
         js = self.resource_string("static/js/src/scormxblock.js")
         jsfrag = MakoTemplate(js).render_unicode(**context)
         frag.add_javascript(jsfrag)
@@ -323,11 +441,11 @@ class ScormXBlock(XBlock):
         """
         Scorm package upload to storage status
         """
-        upload_percent = ScormPackageUploader.get_upload_percentage(self.location.block_id)
+        upload_status = ScormPackageUploader.get_upload_status(self.location.block_id)
 
-        logger.info('Upload percentage is: {}'.format(upload_percent))
+        logger.info('Upload percentage is: {}'.format(upload_status['progress']))
 
-        return Response(json.dumps({"progress": upload_percent}))
+        return Response(json.dumps(upload_status))
 
     @XBlock.handler
     def file_upload_handler(self, request, suffix=''):
@@ -337,27 +455,69 @@ class ScormXBlock(XBlock):
         response = {}
         scorm_uploader = ScormPackageUploader(
             request=request, xblock=self,
-            scorm_storage_location=SCORM_STORAGE
+            scorm_storage_location=SCORM_STORAGE,
+            upload_workers=SCORM_PKG_UPLOAD_WORKERS,
+            upload_max_retries=SCORM_PKG_UPLOAD_MAX_RETRIES,
+            upload_retry_backoff=SCORM_PKG_UPLOAD_RETRY_BACKOFF,
+            stream_extract=SCORM_PKG_STREAM_EXTRACT,
+            deduplicate=SCORM_PKG_DEDUPLICATE,
+            chunk_store_type=SCORM_PKG_CHUNK_STORE,
+            chunk_storage_location=SCORM_PKG_CHUNK_STORAGE_DIR,
+            versioned=SCORM_PKG_VERSIONED,
+            version_grace_period=SCORM_PKG_VERSION_GRACE_PERIOD,
+            precompress=SCORM_PKG_PRECOMPRESS,
+            precompress_min_size=SCORM_PKG_PRECOMPRESS_MIN_SIZE,
+            precompress_types=SCORM_PKG_PRECOMPRESS_TYPES,
+            storage_mode=SCORM_PKG_STORAGE_MODE,
+            job_backend=get_job_backend(SCORM_PKG_JOB_BACKEND, SCORM_PKG_JOB_WORKERS, SCORM_PKG_JOB_QUEUE)
         )
 
         try:
             state, data = scorm_uploader.upload()
+        except ChunkIntegrityError as e:
+            # the chunk wasn't stored, Studio resends it from the offset in upload_offset
+            logger.warning('Scorm package chunk rejected: {}'.format(e.message))
+            return Response(json.dumps({'status': 'retry', 'message': e.message}), status=409,
+                            content_type='application/json')
         except Exception as e:
             logger.error('Scorm package upload error: {}'.format(e.message))
             ScormPackageUploader.clear_percentage_cache(self.location.block_id)
+            ScormPackageUploader.set_upload_phase(self.location.block_id, UPLOAD_PHASE.FAILED, error=e.message)
             return Response(json.dumps({'status': 'error', 'message': e.message}))
 
         if state == UPLOAD_STATE.PROGRESS:
             response = {"files": [{
                 "size": data
             }]}
+            # jquery.fileupload continues from the end of the Range header
+            # so a missing or repeated chunk is resent from the right offset
+            headers = {'Range': 'bytes=0-{}'.format(data - 1)} if data else {}
+            return Response(json.dumps(response), headers=headers)
+        elif state == UPLOAD_STATE.QUEUED:
+            # extraction, storage and publishing happen in a background job, see upload_status
+            response = {'status': 'queued'}
         elif state == UPLOAD_STATE.COMPLETE and data:
             ScormPackageUploader.clear_percentage_cache(self.location.block_id)
-            self.scorm_file = data
+            for field_name, value in data.items():
+                setattr(self, field_name, value)
+            ScormPackageUploader.set_upload_phase(self.location.block_id, UPLOAD_PHASE.DONE)
             response = {'status': 'OK'}
 
         return Response(json.dumps(response))
 
+    @XBlock.handler
+    def upload_offset(self, request, suffix=''):
+        """
+        Number of bytes already received of the package being uploaded,
+        so Studio can resume an interrupted upload
+        """
+        uploaded_bytes = ScormPackageUploader.get_uploaded_bytes(
+            self.location.block_id, request.params.get('name', ''), request.params.get('size', ''),
+            chunk_store_type=SCORM_PKG_CHUNK_STORE,
+            chunk_storage_location=SCORM_PKG_CHUNK_STORAGE_DIR
+        )
+        return Response(json.dumps({'uploaded_bytes': uploaded_bytes}), content_type='application/json')
+
     @XBlock.handler
     def studio_submit(self, request, suffix=''):
         self.display_name = request.params['display_name']
@@ -390,49 +550,93 @@ class ScormXBlock(XBlock):
     # if player sends SCORM API JSON directly
     @XBlock.json_handler
     def scorm_get_value(self, data, suffix=''):
-        name = data.get('name')
-        if name == 'cmi.core.lesson_status':
-            return {'value': self.lesson_status}
-        return {'value': ''}
+        """
+        value of a CMI element, {"name": <element>}, or of several at once,
+        {"names": [<element>, ...]}. "version" ("1.2" or "2004") and "sco"
+        optionally select the data model and the SCO.
+        """
+        if 'names' in data:
+            names = data['names']
+            if not isinstance(names, list) or not all(isinstance(name, six.string_types) for name in names):
+                raise JsonHandlerError(400, 'names must be a list of element names')
+        elif not isinstance(data.get('name', ''), six.string_types):
+            raise JsonHandlerError(400, 'name must be an element name')
+
+        self._store_pending_scorm_status()
+        cmi_model = self._cmi_model(ScormState.from_json(self._load_raw_scorm_status()), data)
+        if 'names' in data:
+            values, errors = cmi_model.get_many(data['names'])
+            return {'values': values, 'errors': errors}
+        value, error = cmi_model.get(data.get('name', ''))
+        return {'value': value, 'error': error}
 
     # if player sends SCORM API JSON directly
     @XBlock.json_handler
     def scorm_set_value(self, data, suffix=''):
-        context = {'result': 'success'}
-        name = data.get('name')
-        if name == 'cmi.core.lesson_status' and data.get('value') != 'completed':
-            self.lesson_status = data.get('value')
-            self._publish_grade()
+        """
+        set a CMI element, {"name": <element>, "value": <value>}, or several at
+        once, {"values": {<element>: <value>, ...}}. Valid values are stored
+        even if others are rejected, all in one save.
+        """
+        if 'values' in data:
+            if not isinstance(data['values'], dict):
+                raise JsonHandlerError(400, 'values must be an object of element names to values')
+        elif not isinstance(data.get('name', ''), six.string_types):
+            raise JsonHandlerError(400, 'name must be an element name')
+
+        self._store_pending_scorm_status()
+        old_scorm_state = ScormState.from_json(self._load_raw_scorm_status())
+        if not self.scorm_initialized:
+            self._init_scos(old_scorm_state)
+        cmi_model = self._cmi_model(old_scorm_state, data)
+        if 'values' in data:
+            errors = cmi_model.set_many(data['values'])
+        else:
+            errors = cmi_model.set_many({data.get('name', ''): data.get('value', '')})
+
+        patch = cmi_model.patch()
+        if patch is not None:
+            scorm_state = old_scorm_state.patched(patch)
+            self._update_scorm_state(old_scorm_state, scorm_state, scorm_state.to_json(), [cmi_model.sco_id])
+
+        context = {'result': 'error' if errors else 'success', 'errors': errors,
+                   'revision': self.raw_scorm_status_revision}
+        if patch is not None and 'score' in patch:
             context.update({"lesson_score": self.lesson_score})
-        if name == 'cmi.core.score.raw':
-            self._set_lesson_score(data.get('value', 0))
         return context
 
-    def _get_all_scos(self):
-        return json.loads(self.raw_scorm_status).get('scos', None)
-
-    def _status_serialize_key(self, key, val):
+    def _cmi_runtime_values(self):
         """
-        update value in JSON serialized raw_scorm_status
-        passing a string key and a deserialized object
+        read only CMI elements provided by the LMS
         """
-        status = json.loads(self.raw_scorm_status)
-        status[key] = val
-        self.raw_scorm_status = json.dumps(status)
-
-    def _scos_set_values(self, key, val, overwrite=False):
+        credit = self.weight > 0 and 'credit' or 'no-credit'
+        return {
+            'cmi.core.student_id': self.student_id, 'cmi.learner_id': self.student_id,
+            'cmi.core.student_name': self.student_name, 'cmi.learner_name': self.student_name,
+            'cmi.core.credit': credit, 'cmi.credit': credit,
+            'cmi.core.lesson_mode': 'normal', 'cmi.mode': 'normal',
+        }
+
+    def _cmi_fallback_values(self):
         """
-        set a value for a key on all scos
-        return new full raw scorm data
+        the block's lesson status and score, read when the SCO has none, e.g.
+        for learners whose player stored its state with set_raw_scorm_status
         """
-        scos = self._get_all_scos()
-        if scos:
-            for sco in scos:
-                if not scos[sco].get('key') or (scos[sco].get('key') and overwrite):
-                    scos[sco][key] = val
-            self._status_serialize_key('scos', scos)
+        lesson_status = self.lesson_status or 'not attempted'
+        fallback_values = {'cmi.core.lesson_status': lesson_status}
+        if lesson_status != 'not attempted':
+            fallback_values['cmi.core.score.raw'] = six.text_type(self.lesson_score)
+        return fallback_values
+
+    def _cmi_model(self, scorm_state, data):
+        try:
+            return CmiDataModel(scorm_state, version=data.get('version', SCORM_12),
+                                sco_id=data.get('sco', DEFAULT_SCO_ID), runtime_values=self._cmi_runtime_values(),
+                                fallback_values=self._cmi_fallback_values())
+        except ValueError as e:
+            raise JsonHandlerError(400, str(e))
 
-    def _init_scos(self):
+    def _init_scos(self, scorm_state):
         """
         initialize all SCOs with proper credit and status values in case
         content package does not do this correctly
@@ -441,8 +645,8 @@ class ScormXBlock(XBlock):
         # set all scos lesson status to 'not attempted'
         # set credit/no-credit on all scos
         credit = self.weight > 0 and 'credit' or 'no-credit'
-        self._scos_set_values('cmi.core.credit', credit)
-        self._scos_set_values('cmi.core.lesson_status', 'not attempted', True)
+        scorm_state.set_sco_values('cmi.core.credit', credit)
+        scorm_state.set_sco_values('cmi.core.lesson_status', 'not attempted', True)
         self.scorm_initialized = True
 
     @XBlock.handler
@@ -452,7 +656,9 @@ class ScormXBlock(XBlock):
         """
         # TODO: handle errors
         # TODO: this is specific to SSLA player at this point.  evaluate for broader use case
-        response = Response(self.raw_scorm_status, content_type='application/json', charset='UTF-8')
+        self._store_pending_scorm_status()
+        response = Response(self._load_raw_scorm_status(), content_type='application/json', charset='UTF-8')
+        response.headers[SCORM_STATUS_REVISION_HEADER] = str(self.raw_scorm_status_revision)
         if self.auto_completion:
             # Mark 100% progress upon launching the scorm content if auto_completion is true
             self._publish_progress(constants.MAX_PROGRESS_VALUE)
@@ -466,27 +672,153 @@ class ScormXBlock(XBlock):
         """
         # TODO: this is specific to SSLA player at this point.  evaluate for broader use case
         data = request.POST['data']
-        scorm_data = json.loads(data)
+        scorm_state = ScormState.from_json(data)
+        coalescer = self._status_coalescer()
+        # with "flush", posted or in the query of the final set url, the status is stored right away
+        flush = bool(request.params.get('flush'))
+        if coalescer is None or not coalescer.commit(
+                self.location, self.scope_ids.user_id, data, store_now_key(scorm_state), flush):
+            self._store_scorm_status(data, scorm_state)
+
+        # TODO: handle errors
+        response = Response(json.dumps(data), content_type='application/json', charset='UTF-8')
+        response.headers[SCORM_STATUS_REVISION_HEADER] = str(self.raw_scorm_status_revision)
+        return response
+
+    @XBlock.handler
+    def flush_raw_scorm_status(self, request, suffix=''):
+        """
+        store the status commit kept by the coalescing window, if any
+        """
+        self._store_pending_scorm_status()
+        return Response(json.dumps({'revision': self.raw_scorm_status_revision}),
+                        content_type='application/json', charset='UTF-8')
+
+    @staticmethod
+    def _status_coalescer():
+        return get_status_coalescer(SCORM_STATUS_COALESCE_WINDOW, SCORM_STATUS_COALESCE_CACHE)
 
-        new_status = scorm_data.get('status', 'not attempted')
+    def _store_pending_scorm_status(self):
+        """
+        store the last status commit kept by the coalescing window, so the
+        handler works on the latest status
+        """
+        coalescer = self._status_coalescer()
+        if coalescer is None:
+            return
+        data = coalescer.pop_pending(self.location, self.scope_ids.user_id)
+        if data is not None:
+            self._store_scorm_status(data)
+
+    def _store_scorm_status(self, data, scorm_state=None):
+        """
+        store a JSON SCORM API status posted by the player, `scorm_state` if it was parsed already
+        """
+        # both states are parsed once and shared by the helpers below
+        if scorm_state is None:
+            scorm_state = ScormState.from_json(data)
 
+        old_scorm_state = ScormState.from_json(self._load_raw_scorm_status())
         if not self.scorm_initialized:
-            self._init_scos()
+            self._init_scos(old_scorm_state)
 
-        old_scorm_data = json.loads(self.raw_scorm_status)
-        self.raw_scorm_status = data
+        # the player sent the state serialized already
+        self._update_scorm_state(old_scorm_state, scorm_state, data)
 
+    @XBlock.handler
+    def patch_raw_scorm_status(self, request, suffix=''):
+        """
+        apply the changes to the JSON SCORM API status made since a revision,
+        posted as {"revision": <revision>, "patch": <JSON merge patch of the status>}.
+        Patches based on an older revision are rejected with a 409, the player
+        must then reload the status. Players numbering their patches with
+        "client" and "sequence" may base a patch on an older revision changed
+        since by their own earlier patches only.
+        """
+        try:
+            body = json.loads(request.body)
+            revision = int(body['revision'])
+            patch = body['patch']
+            client = body.get('client')
+            sequence = int(body.get('sequence', 0))
+        except (ValueError, TypeError, KeyError):
+            return Response(json.dumps({'error': 'invalid patch'}), status=400,
+                            content_type='application/json', charset='UTF-8')
+        self._store_pending_scorm_status()
+        if not isinstance(patch, dict):
+            return Response(json.dumps({'error': 'invalid patch'}), status=400,
+                            content_type='application/json', charset='UTF-8')
+
+        last_patch = self.raw_scorm_status_patch
+        own_patches_only = (
+            client and last_patch.get('client') == client and sequence > last_patch['sequence'] and
+            revision >= last_patch['since']
+        )
+        if revision != self.raw_scorm_status_revision and not own_patches_only:
+            return Response(json.dumps({'error': 'stale revision', 'revision': self.raw_scorm_status_revision}),
+                            status=409, content_type='application/json', charset='UTF-8')
+
+        old_scorm_state = ScormState.from_json(self._load_raw_scorm_status())
+        if not self.scorm_initialized:
+            self._init_scos(old_scorm_state)
+        scorm_state = old_scorm_state.patched(patch)
+        changed_scos = list(patch['scos']) if isinstance(patch.get('scos', {}), dict) else None
+
+        if client:
+            since = last_patch['since'] if last_patch.get('client') == client else revision
+            last_patch = {'client': client, 'sequence': sequence, 'since': since}
+        else:
+            last_patch = None
+        self._update_scorm_state(old_scorm_state, scorm_state, scorm_state.to_json(), changed_scos, last_patch)
+        return Response(json.dumps({'revision': self.raw_scorm_status_revision}),
+                        content_type='application/json', charset='UTF-8')
+
+    def _load_raw_scorm_status(self):
+        return decode_raw_status(self.raw_scorm_status)
+
+    def _store_raw_scorm_status(self, raw_scorm_status):
+        """
+        store a JSON SCORM API status, compressed if enabled. Statuses stored
+        as plain JSON before are compressed on their next change.
+        """
+        if SCORM_STATUS_COMPRESS:
+            raw_scorm_status = encode_raw_status(raw_scorm_status)
+        self.raw_scorm_status = raw_scorm_status
+
+    def _update_scorm_state(self, old_scorm_state, scorm_state, raw_scorm_status, changed_scos=None,
+                            last_patch=None):
+        """
+        store a new SCORM API status, publishing grade and progress.
+        `changed_scos` are the ids of the SCOs that changed, None if any may have.
+        `last_patch` describes the numbered patch of a page making the change, if it is one.
+        """
+        self._store_raw_scorm_status(raw_scorm_status)
+        self.raw_scorm_status_revision += 1
+        self.raw_scorm_status_patch = last_patch or {}
+
+        # statuses stored before the summary existed are summarized once
+        old_summary = self.scorm_summary or summarize_scos(old_scorm_state.scos)
+        if changed_scos is None:
+            summary = summarize_scos(scorm_state.scos)
+        else:
+            summary = updated_summary(old_summary, scorm_state.scos, changed_scos)
+        self.scorm_summary = summary
+
+        new_status = scorm_state.get('status', 'not attempted')
         self.lesson_status = new_status
-        score = scorm_data.get('score', '')
+        score = scorm_state.get('score', '')
+        if score != '':
+            # the score shown to the learner is the one graded
+            self.lesson_score = float(score)
         self._publish_grade(new_status, score)
-        self.publish_progress(old_scorm_data, scorm_data)
+        self._publish_progress_rollup(
+            bool(old_scorm_state), rollup_progress(old_summary), rollup_progress(summary), scorm_state.get('status', '')
+        )
         self.save()
 
-        # TODO: handle errors
-        return Response(json.dumps(self.raw_scorm_status), content_type='application/json', charset='UTF-8')
-
     @XBlock.handler
     def get_scorm_completion(self, request, suffix=''):
+        self._store_pending_scorm_status()
         completion = {'completion': self.scorm_progress or 0}
         return Response(
             json.dumps(completion),
@@ -496,20 +828,160 @@ class ScormXBlock(XBlock):
     @XBlock.handler
     def proxy_content(self, request, suffix=''):
         storage = default_storage
-        contents = ''
-        content_type = 'application/octet-stream'
-        path_to_file = os.path.join(SCORM_STORAGE, self.location.block_id, suffix)
-
-        if storage.exists(path_to_file):
-            f = storage.open(path_to_file, 'rb')
-            contents = f.read()
-            ext = os.path.splitext(path_to_file)[1]
-            if ext in mimetypes.types_map:
-                content_type = mimetypes.types_map[ext]
-        else:
+        package_location = os.path.join(SCORM_STORAGE, self.location.block_id, self.package_version).rstrip('/')
+        path_to_file = os.path.join(package_location, suffix)
+
+        package_index = get_package_index(storage, package_location, versioned=bool(self.package_version))
+        if package_index is not None:
+            # the index lists every stored file, no need to ask storage
+            if suffix not in package_index:
+                return Response('Did not exist in storage: ' + path_to_file, status=404,
+                                content_type='text/html', charset='UTF-8')
+            return self._package_file_response(request, storage, package_index, suffix)
+
+        # packages stored without an index
+        if not storage.exists(path_to_file):
             return Response('Did not exist in storage: ' + path_to_file, status=404,
                             content_type='text/html', charset='UTF-8')
-        return Response(contents, content_type=content_type)
+        redirect_url = self._signed_redirect_url(storage, suffix, path_to_file)
+        if redirect_url:
+            return self._redirect_response(redirect_url)
+        return stored_file_response(
+            request, storage, path_to_file, guess_content_type(path_to_file), cache_max_age=SCORM_PROXY_CACHE_MAX_AGE
+        )
+
+    def _package_file_response(self, request, storage, package_index, path):
+        """
+        Response with a file listed in the package index, compressed if the
+        browser accepts one of its variants, and served from memory or the
+        local disk cache when they are enabled
+        """
+        entry = package_index.get(path)
+        if entry['zip'] is not None and package_index.zip_path:
+            return self._zip_member_response(request, storage, package_index.zip_path, entry)
+
+        redirect_url = self._signed_redirect_url(storage, path, entry['key'], entry['size'])
+        if redirect_url:
+            return self._redirect_response(redirect_url)
+
+        key, size, etag, headers = entry['key'], entry['size'], entry['hash'], {}
+        if entry['encodings']:
+            headers['Vary'] = 'Accept-Encoding'
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'), entry['encodings'])
+            if encoding:
+                key, size = package_index.variant(path, encoding)
+                etag = '{}-{}'.format(entry['hash'], encoding)
+                headers['Content-Encoding'] = encoding
+
+        # revalidated files get a 304 without being read at all
+        if etag not in request.if_none_match:
+            cache_key = (self.location.block_id, self.package_version, key, etag)
+            content_cache = get_content_cache(
+                SCORM_PROXY_MEMORY_CACHE_SIZE, SCORM_PROXY_MEMORY_CACHE_MAX_OBJECT_SIZE, SCORM_PROXY_SHARED_CACHE
+            )
+            if content_cache is not None and content_cache.accepts(size):
+                contents = content_cache.get_or_read(
+                    cache_key, lambda: self._read_package_file(storage, key, cache_key)
+                )
+                return cached_content_response(
+                    request, contents, entry['content_type'], etag=etag,
+                    cache_max_age=SCORM_PROXY_CACHE_MAX_AGE, headers=headers
+                )
+
+            disk_cache = get_disk_cache(SCORM_PROXY_DISK_CACHE_DIR, SCORM_PROXY_DISK_CACHE_SIZE)
+            if disk_cache is not None:
+                local_path = disk_cache.get_or_fill(cache_key, copy_stored_file(storage, key))
+                return content_response(
+                    request, LocalFileIter(local_path), entry['content_type'], size=size,
+                    etag=etag, cache_max_age=SCORM_PROXY_CACHE_MAX_AGE, headers=headers
+                )
+
+        return stored_file_response(
+            request, storage, key, entry['content_type'], size=size, etag=etag,
+            cache_max_age=SCORM_PROXY_CACHE_MAX_AGE, headers=headers
+        )
+
+    def _signed_redirect_url(self, storage, path, key, size=None):
+        """
+        Signed URL of the stored file `key` to redirect to instead of sending
+        the file, None to send it. The LMS buffers a handler's whole response
+        in memory, so large files are redirected whenever a signed URL can be
+        made. Small files and files matching SCORM_PROXY_REDIRECT_EXCLUDE,
+        such as the HTML pages that must be served from the LMS to reach the
+        SCORM API, are always sent. `size` is read from storage if not given.
+        """
+        player_config = DEFINED_PLAYERS.get(self.scorm_player) or {}
+        if not player_config.get('proxy_redirect', SCORM_PROXY_REDIRECT):
+            return None
+        if any(fnmatch.fnmatch(path, pattern) for pattern in SCORM_PROXY_REDIRECT_EXCLUDE):
+            return None
+        if (storage.size(key) if size is None else size) < SCORM_PROXY_REDIRECT_MIN_SIZE:
+            return None
+        return signed_url(
+            storage, key, SCORM_PROXY_REDIRECT_EXPIRY,
+            base_url=SCORM_PROXY_REDIRECT_BASE_URL, signing_key=SCORM_PROXY_REDIRECT_SIGNING_KEY
+        )
+
+    @staticmethod
+    def _redirect_response(redirect_url):
+        response = Response(status=302, location=redirect_url)
+        # the signed URL expires, the redirect must not be reused
+        response.cache_control.no_store = True
+        return response
+
+    def _zip_member_response(self, request, storage, zip_path, entry):
+        """
+        Response with a member of a package stored as a zip, read by byte range
+        from the zip in storage or in the local disk cache. Deflated members are
+        sent as they are stored to browsers accepting gzip, inflated to others.
+        """
+        member, etag, headers = entry['zip'], entry['hash'], {}
+        as_gzip = False
+        if member['method'] == zipfile.ZIP_DEFLATED:
+            headers['Vary'] = 'Accept-Encoding'
+            if choose_encoding(request.headers.get('Accept-Encoding'), [GZIP_ENCODING]) == GZIP_ENCODING:
+                as_gzip = True
+                etag = '{}-{}'.format(entry['hash'], GZIP_ENCODING)
+                headers['Content-Encoding'] = GZIP_ENCODING
+
+        read_range = functools.partial(get_package_storage(storage).read_range, zip_path)
+        # revalidated members get a 304 without being read at all
+        revalidated = etag in request.if_none_match
+        disk_cache = get_disk_cache(SCORM_PROXY_DISK_CACHE_DIR, SCORM_PROXY_DISK_CACHE_SIZE)
+        if disk_cache is not None and not revalidated:
+            local_path = disk_cache.get_or_fill(
+                (self.location.block_id, self.package_version, zip_path, ZIP_STORAGE_MODE),
+                copy_stored_file(storage, zip_path)
+            )
+            read_range = local_range_reader(local_path)
+        app_iter = ZipMemberIter(read_range, member, as_gzip=as_gzip)
+
+        content_cache = get_content_cache(
+            SCORM_PROXY_MEMORY_CACHE_SIZE, SCORM_PROXY_MEMORY_CACHE_MAX_OBJECT_SIZE, SCORM_PROXY_SHARED_CACHE
+        )
+        if content_cache is not None and content_cache.accepts(len(app_iter)) and not revalidated:
+            contents = content_cache.get_or_read(
+                (self.location.block_id, self.package_version, entry['key'], etag), lambda: b''.join(app_iter)
+            )
+            return cached_content_response(
+                request, contents, entry['content_type'], etag=etag,
+                cache_max_age=SCORM_PROXY_CACHE_MAX_AGE, headers=headers
+            )
+
+        return content_response(
+            request, app_iter, entry['content_type'], size=len(app_iter), etag=etag,
+            cache_max_age=SCORM_PROXY_CACHE_MAX_AGE, headers=headers
+        )
+
+    @staticmethod
+    def _read_package_file(storage, path, cache_key):
+        disk_cache = get_disk_cache(SCORM_PROXY_DISK_CACHE_DIR, SCORM_PROXY_DISK_CACHE_SIZE)
+        if disk_cache is not None:
+            path = disk_cache.get_or_fill(cache_key, copy_stored_file(storage, path))
+            with open(path, 'rb') as f:
+                return f.read()
+        with storage.open(path, 'rb') as f:
+            return f.read()
 
     def generate_report_data(self, user_state_iterator, limit_responses=None):
         """
@@ -528,50 +1000,35 @@ class ScormXBlock(XBlock):
             })
         """
 
+        labels = self._report_labels()
         count = 0
-        for user_state in user_state_iterator:
-            for report in self._get_user_report(user_state.state):
+        for username, rows in iter_user_interactions(user_state_iterator, SCORM_REPORT_WORKERS):
+            for row in rows:
 
                 if limit_responses is not None and count >= limit_responses:
                     # End the iterator here
                     return
 
                 count += 1
-                yield (user_state.username, report)
-
-    def _get_user_report(self, user_state):
-        interaction_prefix = "cmi.interactions."
-        raw_status = json.loads(user_state['raw_scorm_status'])
-        scos = raw_status.get('scos', {})
+                yield (username, self._report_row(labels, row))
 
-        for sco in scos.values():
-            sco_data = sco.get('data') or {}
-            interactions_count = sco_data.get(interaction_prefix + '_count', 0)
+    def _report_labels(self):
+        return self.ugettext('Question'), self.ugettext('Answer'), self.ugettext('Submissions count')
 
-            for interaction_index in range(interactions_count):
-                current_interaction_prefix = interaction_prefix + str(interaction_index) + "."
-
-                report = {
-                    self.ugettext('Question'): sco_data.get(current_interaction_prefix + "description"),
-                    self.ugettext('Answer'): sco_data.get(current_interaction_prefix + "learner_response"),
-                    self.ugettext('Submissions count'): interactions_count
-                }
-                yield report
-
-    def _get_value_from_sco(self, sco, key, default):
-        """
-        return a set or default value from a key in a SCO
-        treat blank string values as empty
-        """
-        try:
-            val = sco[key]
-        except (KeyError, ValueError):
-            return default
-        finally:
-            if str(val) == '':
-                return default
-            else:
-                return val
+    @staticmethod
+    def _report_row(labels, row):
+        question_label, answer_label, count_label = labels
+        question, answer, interactions_count = row
+        return {
+            question_label: question,
+            answer_label: answer,
+            count_label: interactions_count
+        }
+
+    def _get_user_report(self, user_state, labels=None):
+        labels = labels or self._report_labels()
+        for row in user_interactions(user_state.get('raw_scorm_status')):
+            yield self._report_row(labels, row)
 
     def _set_lesson_score(self, scos):
         """
@@ -581,11 +1038,7 @@ class ScormXBlock(XBlock):
         # see http://scorm.com/blog/2009/10/score-rollup-in-scorm-1-2-theres-no-silver-bullet/
         # For now we will weight each SCO equally and take an average
         # TODO: handle more complex weighting when we support SCORM2004+
-        total_score = 0
-        for sco in scos.keys():
-            sco = scos[sco]['data']
-            total_score += int(self._get_value_from_sco(sco, 'cmi.core.score.raw', 0))
-        score_rollup = float(total_score) / float(len(list(scos.keys())))
+        score_rollup = rollup_score(summarize_scos(scos)) or 0
         self.lesson_score = score_rollup
         return score_rollup
 
@@ -606,25 +1059,46 @@ class ScormXBlock(XBlock):
         # http://www.ostyn.com/blog/2006/09/scoring-in-scorm.html
         # TODO: handle variable max scores when we support SCORM2004+ or a better KESDEE workaround
         if score != '':
+            value = (float(score) / float(DEFAULT_SCO_MAX_SCORE)) * self.weight
+            # a new weight must always be published
+            publish = self.last_published_max_grade != self.weight or \
+                should_publish(SCORM_PUBLISH_POLICY, self.last_published_grade, value)
+            publish_counters.record('grade', publish)
+            if not publish:
+                return
             self.runtime.publish(
                 self,
                 'grade',
                 {
-                    'value': (float(score) / float(DEFAULT_SCO_MAX_SCORE)) * self.weight,
+                    'value': value,
                     'max_value': self.weight,
                 })
+            self.last_published_grade = value
+            self.last_published_max_grade = self.weight
 
     def publish_progress(self, old_scorm_data, current_scorm_data):
         """
         Update progress % if cmi.progress_measure is emitted (i.e. it exists)
         Else check status and mark 100% completion if course is complete
+        Both states can be parsed JSON or ScormState
+        """
+        old_scorm_data = ScormState.wrap(old_scorm_data)
+        current_scorm_data = ScormState.wrap(current_scorm_data)
+        self._publish_progress_rollup(
+            bool(old_scorm_data), rollup_progress(summarize_scos(old_scorm_data.scos)),
+            rollup_progress(summarize_scos(current_scorm_data.scos)), current_scorm_data.get('status', '')
+        )
+
+    def _publish_progress_rollup(self, had_scorm_data, old_progress_measure, progress_measure, status):
+        """
+        publish_progress from the rolled up progress measures of the old and current data
         """
-        progress_measure = self.calculate_progress_measure(current_scorm_data)
         if progress_measure:
             # We do not want the elif to run if progress_measure exits but is invalid
-            if self.is_progress_measure_valid(progress_measure, old_scorm_data):
+            # progress only goes up, so restarting a scorm course does not reset it on our LMS
+            if not had_scorm_data or (old_progress_measure and progress_measure > old_progress_measure):
                 self._publish_progress(progress_measure)
-        elif current_scorm_data.get('status', '') in constants.SCORM_COMPLETION_STATUS:
+        elif status in constants.SCORM_COMPLETION_STATUS:
             self._publish_progress(constants.MAX_PROGRESS_VALUE)
 
     def _publish_progress(self, completion):
@@ -632,41 +1106,11 @@ class ScormXBlock(XBlock):
         Update completion by calling the completion API
         """
         self.scorm_progress = completion
-        self.runtime.publish(self, 'completion', {'completion': completion})
-
-    def calculate_progress_measure(self, scorm_data):
-        """
-        Returns the averaged progress_measure of all scos in the current scorm content
-        :return: progress_measure if found, else 0
-        """
-        progress_sum = 0
-        scos = scorm_data.get('scos', {})
-        for sco in scos.values():
-            sco_data = sco.get('data', {})
-            try:
-                progress_sum += float(sco_data.get('cmi.progress_measure', '0.0'))
-            except (ValueError, AttributeError):
-                pass
-
-        return progress_sum / len(scos) if len(scos) else 0
-
-    def is_progress_measure_valid(self, current_progress_measure, old_scorm_data):
-        """
-        - Checks if the current progress (to be updated on the LMS) is greater than
-        the previously stored progress
-        - This is done to ensure that restarting a scorm course does not resets its
-        progress on our LMS
-        """
-        if old_scorm_data:
-            # If old data exists for comparison
-            old_progress_measure = self.calculate_progress_measure(old_scorm_data)
-            if old_progress_measure:
-                if current_progress_measure > old_progress_measure:
-                    return True
-            return False
-        else:
-            # If nothing to compare, return valid
-            return True
+        publish = should_publish(SCORM_PUBLISH_POLICY, self.last_published_completion, completion)
+        publish_counters.record('completion', publish)
+        if publish:
+            self.runtime.publish(self, 'completion', {'completion': completion})
+            self.last_published_completion = completion
 
     @staticmethod
     def workbench_scenarios():
@@ -0,0 +1,63 @@
+"""
+Short-lived signed URLs of package files
+
+Instead of sending package files through a Django worker, proxy_content can
+redirect the browser to a URL giving access to the file for a short while:
+a presigned URL on S3, or an HMAC signed path on a static file server sitting
+in front of the storage directory.
+
+Signed paths look like `<base url><storage path>?expires=<timestamp>&signature=<hex>`,
+the signature being the HMAC-SHA256 of "<expires>:<storage path>" with the
+signing key. `verify_signed_path` checks them for servers written in Python.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import hmac
+import time
+
+import six
+from six.moves.urllib.parse import quote, urlencode
+
+from .package_storage import get_package_storage
+
+DEFAULT_SIGNED_URL_EXPIRY = 5 * 60  # 5 Minutes
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, six.text_type) else value
+
+
+def _signature(signing_key, path, expires):
+    message = u'{}:{}'.format(expires, path).encode('utf-8')
+    return hmac.new(_to_bytes(signing_key), message, hashlib.sha256).hexdigest()
+
+
+def sign_path(path, base_url, signing_key, expires_in=DEFAULT_SIGNED_URL_EXPIRY):
+    expires = int(time.time()) + expires_in
+    query = urlencode({'expires': expires, 'signature': _signature(signing_key, path, expires)})
+    return u'{}/{}?{}'.format(base_url.rstrip('/'), quote(_to_bytes(path.lstrip('/'))), query)
+
+
+def verify_signed_path(path, expires, signature, signing_key):
+    """
+    Whether `signature` is valid for `path` and hasn't expired
+    """
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_to_bytes(_signature(signing_key, path, expires)), _to_bytes(signature))
+
+
+def signed_url(storage, path, expires_in=DEFAULT_SIGNED_URL_EXPIRY, base_url=None, signing_key=None):
+    """
+    Signed URL of the stored file at `path`: presigned by the storage backend
+    when it can, else a signed path under `base_url`. None if neither is possible.
+    """
+    url = get_package_storage(storage).signed_url(path, expires_in)
+    if url is None and base_url and signing_key:
+        url = sign_path(path, base_url, signing_key, expires_in)
+    return url
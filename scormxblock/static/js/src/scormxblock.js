@@ -2,81 +2,283 @@ var csrftoken;
 
 function ScormXBlock_${block_id}(runtime, element) {
 
-  function SCORM_API(){
+  // Key of the SCO in the stored status, content launched by the block is a single SCO
+  var SCO_ID = 'sco';
+  var REVISION_HEADER = 'X-Scorm-Status-Revision';
+  var COUNT_RE = /^(cmi\.(?:interactions|objectives))\.(\d+)\./;
+  var COUNT_ELEMENT_RE = /^cmi\.(?:interactions|objectives)\._count$/;
+  var READ_ONLY = 'r';
+
+  // SCORM 1.2 data model of the block: [element pattern, access] and _children values
+  var CMI_ELEMENTS = $.map(${cmi_elements}, function(item) {
+    return [[new RegExp(item[0]), item[1]]];
+  });
+  var CMI_CHILDREN = ${cmi_children};
+  // the learner's values provided by the LMS, and status and score stored by the block
+  var CMI_VALUES = ${cmi_values};
+
+  /*
+  POST that outlives the page when it's left: fetch with keepalive, which unlike
+  sendBeacon carries the CSRF token the handlers require, else a synchronous request
+  */
+  function postOnUnload(url, body) {
+    var csrfToken = $.cookie('csrftoken');
+    if (window.fetch) {
+      window.fetch(url, {
+        method: 'POST',
+        keepalive: true,
+        credentials: 'same-origin',
+        headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+        body: body
+      });
+      return;
+    }
+    $.ajax({
+      type: 'POST', url: url, data: body, contentType: 'application/json', headers: {'X-CSRFToken': csrfToken},
+      async: false
+    });
+  }
 
-    this.LMSInitialize = function(){
-      console.log('LMSInitialize');
-      return true;
-    };
+  var ERROR_STRINGS = {
+    '0': 'No error',
+    '101': 'General exception',
+    '201': 'Invalid argument error',
+    '202': 'Element cannot have children',
+    '203': 'Element not an array - cannot have count',
+    '401': 'Not implemented error',
+    '402': 'Invalid set value, element is a keyword',
+    '403': 'Element is read only'
+  };
+
+  /*
+  SCORM 1.2 API for content launched in the host frame.
+  The CMI data of the SCO is loaded from get_url when the content first calls
+  the API, and kept in the page: LMSGetValue answers from it, and LMSSetValue
+  changes it and records the change. LMSCommit and LMSFinish send all recorded
+  changes in one request to patch_url, and whatever is left is sent when the
+  page is left.
+  The elements are those of the block's SCORM 1.2 data model: unknown elements
+  and writes of read only ones set LMSGetLastError, values aren't type checked,
+  and calls made before LMSInitialize are answered too.
+  */
+  function SCORM_API(getUrl, patchUrl, values) {
+    var self = this;
+    var cmi = {};
+    var revision = 0;
+    var loaded = false;
+    var pending = {};
+    var sending = null;
+    var sendAgain = false;
+    var sentOnUnload = null;
+    var lastError = '0';
+    // patches of the page are numbered, so the one sent on unload applies after one still in flight
+    var client = String(new Date().getTime()) + String(Math.random()).slice(2);
+    var sequence = 0;
+
+    // nothing is loaded nor saved out of the LMS, e.g. in Studio previews
+    var persistent = getUrl && getUrl !== '#';
+
+    function hasPending() {
+      return Object.keys(pending).length > 0;
+    }
 
-    this.LMSFinish = function() {
-      console.log("LMSFinish");
-      return "true";
-    };
+    function startValues(scoData) {
+      var data = $.extend({}, values, scoData);
+      if (!('cmi.core.entry' in data)) {
+        if (data['cmi.core.exit'] === 'suspend') {
+          data['cmi.core.entry'] = 'resume';
+        } else {
+          data['cmi.core.entry'] = data['cmi.core.lesson_status'] === 'not attempted' ? 'ab-initio' : '';
+        }
+      }
+      return data;
+    }
 
-    this.LMSGetValue = function(cmi_element) {
-      console.log("Getvalue for " + cmi_element);
-      var handlerUrl = runtime.handlerUrl(element, 'scorm_get_value');
+    function load(async) {
+      if (!persistent) {
+        cmi = startValues({});
+        loaded = true;
+        return $.Deferred().resolve().promise();
+      }
+      return $.ajax({
+        type: 'GET',
+        url: getUrl,
+        dataType: 'json',
+        async: async
+      }).done(function(status, textStatus, xhr) {
+        var sco = ((status && status.scos) || {})[SCO_ID] || {};
+        cmi = $.extend(startValues(sco.data || {}), sending || {}, pending);
+        revision = parseInt(xhr.getResponseHeader(REVISION_HEADER), 10) || 0;
+        loaded = true;
+      });
+    }
 
-      var response = $.ajax({
-        type: "POST",
-        url: handlerUrl,
-        data: JSON.stringify({'name': cmi_element}),
-        async: false
+    function patchFor(changes) {
+      var patch = {scos: {}};
+      patch.scos[SCO_ID] = {data: changes};
+      if ('cmi.core.lesson_status' in changes) {
+        patch.status = changes['cmi.core.lesson_status'];
+      }
+      if ('cmi.core.score.raw' in changes) {
+        patch.score = changes['cmi.core.score.raw'];
+      }
+      sequence += 1;
+      return JSON.stringify({revision: revision, client: client, sequence: sequence, patch: patch});
+    }
+
+    function send() {
+      if (!persistent || !loaded || !hasPending()) {
+        return;
+      }
+      if (sending) {
+        sendAgain = true;
+        return;
+      }
+      sending = pending;
+      pending = {};
+      $.ajax({
+        type: 'POST',
+        url: patchUrl,
+        data: patchFor(sending),
+        contentType: 'application/json',
+        dataType: 'json'
+      }).done(function(response) {
+        revision = response.revision;
+        sending = null;
+      }).fail(function(xhr) {
+        // keep the changes made since, they're newer
+        pending = $.extend({}, sending, pending);
+        sending = null;
+        if (xhr.status === 409) {
+          // saved from another window meanwhile: send the changes again on top of its data
+          load(true).done(send);
+        }
+      }).always(function() {
+        if (sendAgain && !sending) {
+          sendAgain = false;
+          send();
+        }
       });
-      response = JSON.parse(response.responseText);
-      return response.value
-    };
+    }
+
+    function sendOnUnload() {
+      if (!persistent || !loaded || !(hasPending() || (sending && sending !== sentOnUnload))) {
+        return;
+      }
+      // the request in flight may never complete: its changes are sent again, in a patch
+      // numbered after it, which the block applies even if that request was applied first
+      sentOnUnload = sending;
+      var body = patchFor($.extend({}, sending || {}, pending));
+      pending = {};
+      postOnUnload(patchUrl, body);
+    }
+
+    function access(cmiElement) {
+      for (var i = 0; i < CMI_ELEMENTS.length; i++) {
+        if (CMI_ELEMENTS[i][0].test(cmiElement)) {
+          return CMI_ELEMENTS[i][1];
+        }
+      }
+      return null;
+    }
 
-    this.LMSSetValue = function(cmi_element, value) {
-      console.log("LMSSetValue " + cmi_element + " = " + value);
-      var handlerUrl = runtime.handlerUrl(element, 'scorm_set_value');
+    function result(error, value) {
+      lastError = error;
+      return value;
+    }
 
-      if (cmi_element == 'cmi.core.lesson_status'||cmi_element == 'cmi.core.score.raw'){
+    this.LMSInitialize = function() {
+      if (!loaded) {
+        load(false);
+      }
+      return result('0', 'true');
+    };
 
-        $.ajax({
-          type: "POST",
-          url: handlerUrl,
-          data: JSON.stringify({'name': cmi_element, 'value': value}),
-          async: false,
-          success: function(response){
-            if (typeof response.lesson_score != "undefined"){
-              $(".lesson_score", element).html(response.lesson_score);
-            }
-          }
-        });
+    this.LMSFinish = function() {
+      send();
+      return result('0', 'true');
+    };
 
+    this.LMSGetValue = function(cmiElement) {
+      if (!loaded) {
+        load(false);
       }
-      return true;
+      cmiElement = String(cmiElement || '');
+      if (cmiElement in CMI_CHILDREN) {
+        return result('0', CMI_CHILDREN[cmiElement]);
+      }
+      if (/\._children$/.test(cmiElement)) {
+        return result('202', '');
+      }
+      if (/\._count$/.test(cmiElement)) {
+        return COUNT_ELEMENT_RE.test(cmiElement) ? result('0', String(cmi[cmiElement] || 0)) : result('203', '');
+      }
+      if (!cmiElement) {
+        return result('201', '');
+      }
+      if (access(cmiElement) === null) {
+        return result('401', '');
+      }
+      var value = cmi[cmiElement];
+      return result('0', value === undefined || value === null ? '' : String(value));
+    };
+
+    this.LMSSetValue = function(cmiElement, value) {
+      cmiElement = String(cmiElement || '');
+      if (/\._(children|count)$/.test(cmiElement)) {
+        return result('402', 'false');
+      }
+      var elementAccess = access(cmiElement);
+      if (elementAccess === null) {
+        return result(cmiElement ? '401' : '201', 'false');
+      }
+      if (elementAccess === READ_ONLY) {
+        return result('403', 'false');
+      }
+      value = String(value);
+      cmi[cmiElement] = value;
+      pending[cmiElement] = value;
+
+      // keep the counts of interactions and objectives, reports rely on them
+      var match = COUNT_RE.exec(cmiElement);
+      if (match) {
+        var countKey = match[1] + '._count';
+        var count = parseInt(match[2], 10) + 1;
+        if (!(cmi[countKey] >= count)) {
+          cmi[countKey] = count;
+          pending[countKey] = count;
+        }
+      }
+      if (cmiElement === 'cmi.core.score.raw') {
+        $('.lesson_score', element).html(value);
+      }
+      return result('0', 'true');
     };
 
-    /*
-    TODO: this is all racoongang stubs
     this.LMSCommit = function() {
-        console.log("LMSCommit");
-        return "true";
+      send();
+      return result('0', 'true');
     };
 
     this.LMSGetLastError = function() {
-      console.log("GetLastError");
-      return "0";
+      return lastError;
     };
 
     this.LMSGetErrorString = function(errorCode) {
-      console.log("LMSGetErrorString");
-      return "Some Error";
+      return ERROR_STRINGS[String(errorCode)] || ERROR_STRINGS['101'];
     };
 
     this.LMSGetDiagnostic = function(errorCode) {
-      console.log("LMSGetDiagnostic");
-      return "Some Diagnostice";
-    }
-    */
+      return self.LMSGetErrorString(errorCode || lastError);
+    };
 
+    // nothing is loaded until the content calls the API, views of the block alone don't request it
+    $(window).on('pagehide beforeunload', sendOnUnload);
   }
 
   $(function ($) {
-    API = new SCORM_API();
+    var host_frame = $('#scormxblock-${block_id}');
+    API = new SCORM_API(host_frame.data('get_url'), host_frame.data('patch_url'), CMI_VALUES);
     console.log("Initial SCORM data...");
     const completedFeedbackText = gettext('Content is complete, please continue.');
     const incompleteFeedbackText = gettext('Complete all content to continue.');
@@ -87,6 +289,14 @@ function ScormXBlock_${block_id}(runtime, element) {
     host_frame_${block_id} = $('#scormxblock-${block_id}');
     host_frame_${block_id}.data('csrftoken', $.cookie('csrftoken'));
 
+    // store the last status commit kept by the coalescing window when the learner leaves
+    $(window).on('pagehide', function() {
+      var flushUrl = host_frame_${block_id}.data('flush_url');
+      if (flushUrl && flushUrl !== '#') {
+        postOnUnload(flushUrl, '{}');
+      }
+    });
+
     let isRNApp = (/com.mcka.RNApp/i.test(navigator.userAgent.toLowerCase()));
     if (isRNApp) {
       host_frame_${block_id}.data('display_type', 'iframe')
@@ -2,7 +2,11 @@ function ScormStudioXBlock(runtime, element) {
   var new_scorm_file_uploaded = false;
   var handlerUrl = runtime.handlerUrl(element, 'studio_submit');
   var fileUploadUrl = runtime.handlerUrl(element, 'file_upload_handler');
+  var uploadOffsetUrl = runtime.handlerUrl(element, 'upload_offset');
   var pollingParams = {id: null, interval: 5000, url: runtime.handlerUrl(element, 'upload_status')};
+  var chunkSize = 20 * 1000000; // 20 MB
+  var retryParams = {count: 0, max: 5, delay: 3000};
+  var chunkChecksums = [];
 
   function log(msg){
     console.log(msg);
@@ -15,13 +19,24 @@ function ScormStudioXBlock(runtime, element) {
     $(element).find('.status-container .progress-percent').text(percentVal);
   }
   
+  var phaseSteps = {
+    uploading: 'Uploading',
+    received: 'Upload received',
+    extracting: 'Unpacking',
+    storing: 'Unpack and Storing',
+    publishing: 'Publishing'
+  };
+
   function pollUploadStatus() {
     $.getJSON(pollingParams.url, function(data) {
       var percentVal = data.progress + '%';
-      updateProgressUI('Unpack and Storing', percentVal);
+      updateProgressUI(phaseSteps[data.phase] || 'Unpack and Storing', percentVal);
 
-      if(percentVal == '100%'){
-        clearInterval(pollingParams.id);
+      if(data.phase == 'failed'){
+        pollingParams.id = null;
+        showUploadError(data.error);
+      }else if(data.phase == 'done' || (!data.phase && percentVal == '100%')){
+        pollingParams.id = null;
         $(element).find('.status-container .success-msg').text('Scorm package has been succesfully uploaded!');
          $(element).find('.save-button').removeClass('disabled');
           new_scorm_file_uploaded = true;
@@ -31,6 +46,81 @@ function ScormStudioXBlock(runtime, element) {
     });
   }
   
+  function toHex(buffer) {
+    var bytes = new Uint8Array(buffer), hex = '';
+    for (var i = 0; i < bytes.length; i++) {
+      hex += ('0' + bytes[i].toString(16)).slice(-2);
+    }
+    return hex;
+  }
+
+  // SHA-256 of every chunk of the file, sent along with the chunk so the server
+  // can reject a corrupted one. Skipped where the browser has no WebCrypto.
+  function computeChunkChecksums(file, callback) {
+    var checksums = [];
+    if (!(window.crypto && window.crypto.subtle && window.FileReader)) {
+      callback(checksums);
+      return;
+    }
+
+    function checksumChunk(start) {
+      if (start >= file.size) {
+        callback(checksums);
+        return;
+      }
+      var reader = new FileReader();
+      reader.onload = function() {
+        window.crypto.subtle.digest('SHA-256', reader.result).then(function(digest) {
+          checksums.push(toHex(digest));
+          checksumChunk(start + chunkSize);
+        }, function() {
+          callback([]);
+        });
+      };
+      reader.onerror = function() {
+        callback([]);
+      };
+      reader.readAsArrayBuffer(file.slice(start, start + chunkSize));
+    }
+    checksumChunk(0);
+  }
+
+  // Bytes of the file the server already has, to resume an interrupted upload
+  function getUploadOffset(file, callback) {
+    $.getJSON(uploadOffsetUrl, {name: file.name, size: file.size})
+      .done(function(data) {
+        var offset = data.uploaded_bytes || 0;
+        callback(offset < file.size ? offset : 0);
+      })
+      .fail(function() {
+        callback(0);
+      });
+  }
+
+  function showUploadError(message) {
+    alert('Error while uploading scorm package: ' + message);
+
+    $(element).find('.file-chosen').text('');
+    $(element).find('#scorm-file-select').show();
+    $(element).find('.status-container').hide();
+    $(element).find('.save-button').removeClass('disabled')
+  }
+
+  function submitUpload(data) {
+    getUploadOffset(data.files[0], function(offset) {
+      if (offset) {
+        log('Resuming upload at byte ' + offset);
+      }
+      data.uploadedBytes = offset;
+      data.data = null;
+      data.submit().complete(function(result, textStatus, xhr) {
+          if(result.status == 'error'){
+            showUploadError(result.message);
+          }
+      });
+    });
+  }
+
   $(element).find('#scorm-file-select').bind('click', function(e) {
     e.preventDefault();
     $('#scorm_file').click();
@@ -39,7 +129,7 @@ function ScormStudioXBlock(runtime, element) {
   $(element).find('#scorm_file').fileupload({
     dataType: 'json',
     type: 'POST',
-    maxChunkSize: 20 * 1000000, // 20 MB
+    maxChunkSize: chunkSize,
     autoUpload: false,
     url: fileUploadUrl,
     add: function(e, data) {
@@ -51,17 +141,35 @@ function ScormStudioXBlock(runtime, element) {
       $(element).find('.status-container').show();
       $(element).find('.save-button').addClass('disabled');
 
-      data.submit().complete(function(result, textStatus, xhr) {
-          if(result.status == 'error'){
-            alert('Error while uploading scorm package: ' + result.message);
-
-            $(element).find('.file-chosen').text('');
-            $(element).find('#scorm-file-select').show();
-            $(element).find('.status-container').hide();
-            $(element).find('.save-button').removeClass('disabled')
-          }
+      retryParams.count = 0;
+      updateProgressUI('Preparing', '0%');
+      computeChunkChecksums(file, function(checksums) {
+        chunkChecksums = checksums;
+        submitUpload(data);
       });
-
+    },
+    chunksend: function(e, data) {
+      var start = parseInt(data.contentRange.split(' ')[1], 10),
+          index = start / chunkSize;
+      // checksums were computed for chunks aligned on chunkSize
+      if (index % 1 === 0 && chunkChecksums[index] &&
+          data.chunkSize === Math.min(chunkSize, data.files[0].size - start)) {
+        data.headers['X-Chunk-Checksum'] = 'sha256=' + chunkChecksums[index];
+      }
+    },
+    chunkdone: function(e, data) {
+      retryParams.count = 0;
+    },
+    fail: function(e, data) {
+      if (data.errorThrown === 'abort' || retryParams.count >= retryParams.max) {
+        showUploadError(data.errorThrown || data.textStatus);
+        return;
+      }
+      retryParams.count += 1;
+      log('Upload interrupted, retry ' + retryParams.count + ' of ' + retryParams.max);
+      setTimeout(function() {
+        submitUpload(data);
+      }, retryParams.delay);
     },
     progressall: function(e, data) {
       var percentInt = data.loaded / data.total * 100,
@@ -70,7 +178,7 @@ function ScormStudioXBlock(runtime, element) {
 
       updateProgressUI('Uploading', percentVal);
 
-      if(percentInt >= doneAt){
+      if(percentInt >= doneAt && !pollingParams.id){
         pollingParams.id = setTimeout(pollUploadStatus, 3000);
       }
     }
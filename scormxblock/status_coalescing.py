@@ -0,0 +1,163 @@
+"""
+Coalescing of SCORM status commits
+
+Some players post the whole status many times a second. With a coalescing
+window, a commit arriving less than the window after the learner's last
+stored one is only kept in a Django cache, as the learner's pending commit.
+A commit changing a status or score, which are graded, or the exit or session
+time players set when a session ends, is always stored, as is a commit posted
+with flush. The pending commit is stored by the next commit after the window,
+which supersedes it, or by the next request of the learner for the block,
+e.g. the flush posted when the page is left.
+
+Every commit is numbered with an atomic increment and kept under a key of its
+own, so concurrent processes never overwrite a newer commit with an older one,
+and an `add` claims the pending commit, so it's stored only once.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .scorm_summary import sco_summary
+
+logger = logging.getLogger(__name__)
+
+# how long a pending commit is kept for a flush
+PENDING_TIMEOUT = 24 * 60 * 60  # 1 day
+
+SESSION_END_ELEMENTS = ('cmi.core.exit', 'cmi.exit', 'cmi.core.session_time', 'cmi.session_time')
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+def store_now_key(scorm_state):
+    """
+    The values of a state a commit is stored right away when they change:
+    its status and score and those of every SCO, which are graded, and the
+    SCOs' exit and session time, set at the end of a session
+    """
+    scos = []
+    for sco_id, sco in scorm_state.scos.items():
+        if isinstance(sco, dict):
+            summary = sco_summary(sco)
+            sco_data = sco.get('data') or {}
+            scos.append([sco_id, summary['status'], summary['score']] +
+                        [sco_data.get(name) for name in SESSION_END_ELEMENTS])
+    scos.sort()
+    return json.dumps([scorm_state.get('status'), scorm_state.get('score'), scos])
+
+
+class StatusCoalescer(object):
+    """
+    Commits of every learner and block within `window` seconds, kept in the
+    Django cache `cache_alias`
+    """
+    def __init__(self, window, cache_alias='default'):
+        self.window = window
+        self.cache = caches[cache_alias]
+        self.commits = 0
+        self.writes = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(usage_id, user_id, name):
+        return 'scorm_status:{}:{}'.format(
+            hashlib.md5(u'{}:{}'.format(usage_id, user_id).encode('utf-8')).hexdigest(), name
+        )
+
+    def _count(self, written):
+        with self._lock:
+            self.commits += 1
+            if written:
+                self.writes += 1
+            else:
+                self.coalesced += 1
+
+    def _next_number(self, usage_id, user_id):
+        """
+        Number of a new commit, greater than those of the earlier ones, None if the cache lost the count
+        """
+        key = self._key(usage_id, user_id, 'number')
+        # starting from the time keeps the numbers growing if the count is evicted
+        self.cache.add(key, int(time.time() * 1000), PENDING_TIMEOUT)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            return None
+
+    def commit(self, usage_id, user_id, raw_status, store_now=None, flush=False):
+        """
+        Keep `raw_status` as the learner's pending commit, unless it must be
+        stored now: after the window, with `flush` or when its `store_now_key`
+        `store_now` changed. Returns True if it was kept, False if the caller stores it.
+        """
+        number = self._next_number(usage_id, user_id)
+        store_now_cache_key = self._key(usage_id, user_id, 'store_now')
+        changed = self.cache.get(store_now_cache_key) != store_now
+        self.cache.set(store_now_cache_key, store_now, PENDING_TIMEOUT)
+        # the first commit in a window is stored and opens it
+        window_open = not self.cache.add(self._key(usage_id, user_id, 'window'), True, self.window)
+
+        if flush or number is None or changed or not window_open:
+            # any pending commit has a smaller number, it's never stored
+            self._count(written=True)
+            return False
+        self.cache.set(self._key(usage_id, user_id, 'pending:{}'.format(number)), raw_status, PENDING_TIMEOUT)
+        self._count(written=False)
+        return True
+
+    def pop_pending(self, usage_id, user_id):
+        """
+        The learner's pending commit to store now, None if there is none or
+        a later commit was stored
+        """
+        number = self.cache.get(self._key(usage_id, user_id, 'number'))
+        if number is None:
+            return None
+        raw_status = self.cache.get(self._key(usage_id, user_id, 'pending:{}'.format(number)))
+        if raw_status is None:
+            return None
+        if not self.cache.add(self._key(usage_id, user_id, 'stored:{}'.format(number)), True, PENDING_TIMEOUT):
+            # another process is storing it
+            return None
+        with self._lock:
+            self.writes += 1
+        return raw_status
+
+    def stats(self):
+        with self._lock:
+            return {
+                'commits': self.commits,
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'coalesced_ratio': float(self.coalesced) / self.commits if self.commits else 0.0,
+            }
+
+
+def get_status_coalescer(window, cache_alias='default'):
+    """
+    The coalescer of this process for `window` and `cache_alias`, None when
+    disabled or when the cache isn't shared by the LMS processes
+    """
+    if not window:
+        return None
+    with _coalescers_lock:
+        if (window, cache_alias) not in _coalescers:
+            coalescer = StatusCoalescer(window, cache_alias)
+            if isinstance(coalescer.cache, (LocMemCache, DummyCache)):
+                logger.warning('SCORM status commits not coalesced, cache {} is not shared by processes'.format(
+                    cache_alias
+                ))
+                coalescer = None
+            _coalescers[(window, cache_alias)] = coalescer
+        return _coalescers[(window, cache_alias)]
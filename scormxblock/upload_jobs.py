@@ -0,0 +1,118 @@
+"""
+Background processing of uploaded SCORM packages
+
+Extracting and storing a package can take minutes, so the request carrying the
+last chunk only queues a job. The job extracts and stores the package, then
+publishes it by saving the block's fields through the modulestore.
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .scorm_file_uploader import PHASE, ScormPackageExtractor, ScormPackageUploader
+
+try:
+    from celery import shared_task
+except ImportError:
+    shared_task = None
+
+logger = logging.getLogger(__name__)
+
+SYNC_JOB_BACKEND = 'sync'
+THREAD_JOB_BACKEND = 'thread'
+CELERY_JOB_BACKEND = 'celery'
+
+DEFAULT_JOB_WORKERS = 2
+
+
+def publish_package(usage_id, user_id, package_fields):
+    """
+    Save the fields pointing the block to its newly stored package
+    """
+    from opaque_keys.edx.keys import UsageKey
+    from xmodule.modulestore import ModuleStoreEnum
+    from xmodule.modulestore.django import modulestore
+
+    usage_key = UsageKey.from_string(usage_id)
+    store = modulestore()
+    with store.branch_setting(ModuleStoreEnum.Branch.draft_preferred, usage_key.course_key):
+        block = store.get_item(usage_key)
+        for field_name, value in package_fields.items():
+            setattr(block, field_name, value)
+        store.update_item(block, user_id)
+
+
+def process_package(usage_id, user_id, extractor_kwargs, size=None):
+    """
+    Extract, store and publish an uploaded package, recording the phase it's in
+    """
+    block_id = extractor_kwargs['block_id']
+    try:
+        package_fields = ScormPackageExtractor(**extractor_kwargs).extract_and_store(size)
+        ScormPackageUploader.set_upload_phase(block_id, PHASE.PUBLISHING)
+        publish_package(usage_id, user_id, package_fields)
+        ScormPackageUploader.set_upload_phase(block_id, PHASE.DONE)
+    except Exception as e:
+        logger.exception('Scorm package processing error for {}'.format(usage_id))
+        ScormPackageUploader.set_upload_phase(block_id, PHASE.FAILED, error=u'{}'.format(e))
+    finally:
+        try:
+            from django.db import close_old_connections
+            close_old_connections()
+        except ImportError:
+            pass
+
+
+if shared_task is not None:
+    process_package_task = shared_task(name='scormxblock.process_package')(process_package)
+else:
+    process_package_task = None
+
+
+class ThreadPoolJobBackend(object):
+    """
+    Runs jobs on a pool of threads in the process that received the upload
+    """
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, workers=DEFAULT_JOB_WORKERS):
+        self.workers = max(int(workers), 1)
+
+    def _get_pool(self):
+        # one pool per process, created lazily so forked workers don't share it
+        with ThreadPoolJobBackend._pool_lock:
+            if ThreadPoolJobBackend._pool is None:
+                ThreadPoolJobBackend._pool = ThreadPool(self.workers)
+            return ThreadPoolJobBackend._pool
+
+    def enqueue(self, usage_id, user_id, extractor_kwargs, size=None):
+        self._get_pool().apply_async(process_package, (usage_id, user_id, extractor_kwargs, size))
+
+
+class CeleryJobBackend(object):
+    """
+    Runs jobs as Celery tasks. The worker must be able to read the uploaded
+    package, i.e. the "storage" chunk store should be used.
+    """
+    def __init__(self, queue=None):
+        self.queue = queue
+
+    def enqueue(self, usage_id, user_id, extractor_kwargs, size=None):
+        options = {'queue': self.queue} if self.queue else {}
+        process_package_task.apply_async(args=(usage_id, user_id, extractor_kwargs, size), **options)
+
+
+def get_job_backend(backend_type, workers=DEFAULT_JOB_WORKERS, queue=None):
+    """
+    Job backend for `backend_type`, None to process packages within the request
+    """
+    if backend_type == SYNC_JOB_BACKEND:
+        return None
+    if backend_type == CELERY_JOB_BACKEND:
+        if process_package_task is not None:
+            return CeleryJobBackend(queue)
+        logger.warning('Celery is not installed, processing SCORM packages in a thread pool')
+    return ThreadPoolJobBackend(workers)
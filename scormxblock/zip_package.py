@@ -0,0 +1,156 @@
+"""
+Packages stored as their uploaded zip
+
+Instead of storing every file of a package as its own object, the zip is
+stored as it is and the package index records where the data of every member
+starts. proxy_content then reads just that byte range, sending stored members
+as they are, deflated ones either inflated on the fly or, to browsers
+accepting gzip, wrapped in a gzip header and trailer without recompressing.
+"""
+from __future__ import absolute_import
+
+import struct
+import zipfile
+import zlib
+
+ZIP_STORAGE_MODE = 'zip'
+FILES_STORAGE_MODE = 'files'
+
+SUPPORTED_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+ZIP_ENCRYPTED_FLAG = 0x1
+
+# local file header: signature, versions, flags, method, time, date, CRC, sizes, name and extra lengths
+LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+# gzip member header with no name, no mtime and "unknown" OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+GZIP_TRAILER_SIZE = 8
+
+LOCAL_READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_zip_path(package_location):
+    return '{}.zip'.format(package_location)
+
+
+def is_servable(info):
+    """
+    Whether proxy_content can serve the zip member straight from the zip
+    """
+    return info.compress_type in SUPPORTED_METHODS and not info.flag_bits & ZIP_ENCRYPTED_FLAG
+
+
+def member_data_offset(zip_file, info):
+    """
+    Offset of the member's compressed data: the local header's name and
+    extra field lengths can differ from the central directory's
+    """
+    zip_file.fp.seek(info.header_offset)
+    header = struct.unpack(LOCAL_HEADER_FORMAT, zip_file.fp.read(LOCAL_HEADER_SIZE))
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipfile('Bad local file header for {}'.format(info.filename))
+    return info.header_offset + LOCAL_HEADER_SIZE + header[10] + header[11]
+
+
+def _slice_chunks(chunks, start, stop):
+    """
+    Bytes `start` to `stop` (exclusive, None for the end) of a stream of chunks
+    """
+    position = 0
+    for chunk in chunks:
+        chunk_start, chunk_end = position, position + len(chunk)
+        position = chunk_end
+        if chunk_end <= start:
+            continue
+        if stop is not None and chunk_start >= stop:
+            break
+        yield chunk[max(start - chunk_start, 0):None if stop is None else stop - chunk_start]
+
+
+class ZipMemberIter(object):
+    """
+    `app_iter` sending a zip member read through `read_range(start, stop)`.
+    `member` is the zip info recorded in the package index.
+    """
+    def __init__(self, read_range, member, as_gzip=False, start=0, stop=None):
+        self.read_range = read_range
+        self.member = member
+        self.as_gzip = as_gzip
+        self.start = start
+        self.stop = stop
+
+    @property
+    def inflated(self):
+        return self.member['method'] == zipfile.ZIP_DEFLATED and not self.as_gzip
+
+    def __len__(self):
+        if self.as_gzip:
+            return len(GZIP_HEADER) + self.member['compressed_size'] + GZIP_TRAILER_SIZE
+        return self.member['size']
+
+    def __iter__(self):
+        stop = len(self) if self.stop is None else min(self.stop, len(self))
+        if self.start >= stop:
+            return iter([])
+        if self.inflated:
+            return _slice_chunks(self._inflate(), self.start, stop)
+        if self.as_gzip:
+            return self._gzip(self.start, stop)
+        offset = self.member['offset']
+        return iter(self.read_range(offset + self.start, offset + stop))
+
+    def _raw(self):
+        offset = self.member['offset']
+        return self.read_range(offset, offset + self.member['compressed_size'])
+
+    def _inflate(self):
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for chunk in self._raw():
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def _gzip(self, start, stop):
+        """
+        Bytes `start` to `stop` of the member as a gzip file: the deflated
+        data framed by a gzip header and a trailer with its CRC and size
+        """
+        header_size = len(GZIP_HEADER)
+        data_end = header_size + self.member['compressed_size']
+        if start < header_size:
+            yield GZIP_HEADER[start:min(stop, header_size)]
+
+        data_start, data_stop = max(start, header_size), min(stop, data_end)
+        if data_stop > data_start:
+            offset = self.member['offset'] - header_size
+            for chunk in self.read_range(offset + data_start, offset + data_stop):
+                yield chunk
+
+        if stop > data_end:
+            trailer = struct.pack('<LL', self.member['crc'] & 0xffffffff, self.member['size'] & 0xffffffff)
+            yield trailer[max(start - data_end, 0):stop - data_end]
+
+    def app_iter_range(self, start, stop):
+        return ZipMemberIter(self.read_range, self.member, self.as_gzip, start, stop)
+
+
+def local_range_reader(local_path):
+    """
+    `read_range` of a zip kept on local disk
+    """
+    def read_range(start, stop):
+        with open(local_path, 'rb') as local_file:
+            local_file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = local_file.read(min(LOCAL_READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return read_range